@@ -0,0 +1,116 @@
+"""Contention benchmark for stock reservations.
+
+Hundreds of buyers try to reserve the same product at once. Each run reports
+throughput, latency and whether the product was oversold. The run uses a
+scratch database, ``<DB_NAME>_bench``, which is dropped afterwards.
+
+    python bench_reservations.py                          # 500 buyers, 100 in stock
+    python bench_reservations.py --buyers 1000 --stock 250 --quantity 2
+
+The ``naive`` run shows the read-check-write pattern that oversells. The
+``atomic`` run uses ``StockReservations.reserve``, and the script exits 1 if
+that run oversells.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from indexes import create_indexes
+from reservations import InsufficientStock, StockReservations
+
+logger = logging.getLogger(__name__)
+
+HOT_PRODUCT = "bench-hot-sku"
+
+
+async def _naive_reserve(db, user_id: str, product_id: str, quantity: int):
+    # Stock check and decrement are separate round-trips, so buyers interleave between them
+    product = await db.products.find_one({"id": product_id}, {"_id": 0, "stok": 1})
+    if product["stok"] < quantity:
+        raise InsufficientStock(product_id, product["stok"])
+    await db.products.update_one({"id": product_id}, {"$set": {"stok": product["stok"] - quantity}})
+
+
+async def run(db, mode: str, buyers: int, stock: int, quantity: int) -> dict:
+    await db.products.delete_many({"id": HOT_PRODUCT})
+    await db.reserved_stock.delete_many({})
+    await db.stock_reservations.delete_many({})
+    await db.products.insert_one({"id": HOT_PRODUCT, "nama": "Flash Sale", "stok": stock})
+    reservations = StockReservations(db)
+
+    latencies = []
+
+    async def buyer(i: int) -> bool:
+        started = time.perf_counter()
+        try:
+            if mode == "atomic":
+                await reservations.reserve(f"bench-user-{i}", HOT_PRODUCT, quantity)
+            else:
+                await _naive_reserve(db, f"bench-user-{i}", HOT_PRODUCT, quantity)
+            return True
+        except InsufficientStock:
+            return False
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(buyer(i) for i in range(buyers)))
+    elapsed = time.perf_counter() - started
+
+    sold = sum(results) * quantity
+    remaining = (await db.products.find_one({"id": HOT_PRODUCT}))["stok"]
+    # Reservations leave stok alone and count what they hold in reserved_stock
+    held = await db.reserved_stock.find_one({"_id": HOT_PRODUCT})
+    remaining -= (held or {}).get("quantity", 0)
+    latencies.sort()
+    return {
+        "mode": mode,
+        "buyers": buyers,
+        "successful": sum(results),
+        "sold": sold,
+        "remaining": remaining,
+        # Units handed out beyond what was in stock, or decrements lost to races
+        "oversold": max(sold - stock, 0) + max(stock - sold - remaining, 0),
+        "elapsed": elapsed,
+        "throughput": buyers / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+
+async def main(args) -> int:
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[f"{os.environ['DB_NAME']}_bench"]
+    failed = False
+    try:
+        await create_indexes(db)
+        for mode in ("naive", "atomic"):
+            result = await run(db, mode, args.buyers, args.stock, args.quantity)
+            logger.info(
+                "%(mode)-6s %(buyers)d buyers: %(successful)d succeeded, %(sold)d sold, %(remaining)d left, "
+                "%(oversold)d oversold | %(throughput).0f req/s, p50 %(p50_ms).1f ms, p99 %(p99_ms).1f ms",
+                result,
+            )
+            if mode == "atomic" and result["oversold"]:
+                failed = True
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Benchmark stock reservations on a single hot product")
+    parser.add_argument("--buyers", type=int, default=500, help="concurrent buyers")
+    parser.add_argument("--stock", type=int, default=100, help="initial stock of the hot product")
+    parser.add_argument("--quantity", type=int, default=1, help="units each buyer reserves")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,108 @@
+"""Import-time benchmark for worker startup.
+
+Imports server.py in fresh interpreters under ``python -X importtime`` and
+reports the median time to import it, plus the slowest modules by self time.
+Nothing connects to MongoDB; importing server.py opens no client.
+
+    python bench_startup.py                      # 5 runs against startup_baseline.json
+    python bench_startup.py --runs 15 --record   # re-record the baseline on this machine
+    python bench_startup.py --runs 10 --budget-ms 1200 --top 25
+
+The budget is the recorded baseline plus ``--tolerance`` (default 15%), or
+an absolute ``--budget-ms`` / STARTUP_IMPORT_BUDGET_MS. Import times differ a
+lot between machines, so record the baseline where the check runs. Exits 1
+if the median import time is over the budget, or if a module that should
+load on first use, such as PyJWT or passlib, is imported with the app.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ROOT_DIR = Path(__file__).parent
+BASELINE = ROOT_DIR / "startup_baseline.json"
+
+# Loaded on first use or only by the setup scripts, never by importing the app
+DEFERRED = ("jwt", "passlib", "bcrypt", "seed")
+
+
+def import_times(module: str) -> List[Tuple[str, int, int]]:
+    """(module, self µs, cumulative µs) for every import made by ``import <module>`` in a fresh interpreter."""
+    env = {"MONGO_URL": "mongodb://localhost:27017", "DB_NAME": "bench_startup", **os.environ}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def main(args) -> int:
+    # The first run may write bytecode caches; keep it out of the numbers
+    import_times("server")
+    totals = []
+    self_times: Dict[str, List[int]] = {}
+    for _ in range(args.runs):
+        rows = import_times("server")
+        totals.append(next(cumulative for name, _, cumulative in rows if name == "server") / 1000)
+        for name, self_us, _ in rows:
+            self_times.setdefault(name, []).append(self_us)
+    imported = set(self_times)
+
+    median = statistics.median(totals)
+    print(f"import server: median {median:.0f} ms, min {min(totals):.0f} ms, max {max(totals):.0f} ms over {args.runs} runs")
+    if args.top:
+        print(f"\n{'module':<50}{'self ms':>10}")
+        slowest = sorted(self_times.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+        for name, times in slowest[:args.top]:
+            print(f"{name:<50}{statistics.median(times) / 1000:>10.1f}")
+
+    if args.record:
+        Path(args.baseline).write_text(json.dumps({
+            "median_ms": round(median, 1),
+            "runs": args.runs,
+            "python": platform.python_version(),
+        }, indent=2) + "\n")
+        print(f"\nRecorded baseline in {args.baseline}")
+
+    failed = False
+    eager = [name for name in DEFERRED if name in imported]
+    if eager:
+        print(f"\nFAIL: imported at startup, should load on first use: {', '.join(eager)}")
+        failed = True
+    budget = args.budget_ms
+    if budget is None and Path(args.baseline).exists():
+        baseline = json.loads(Path(args.baseline).read_text())
+        budget = baseline["median_ms"] * (1 + args.tolerance)
+        print(f"\nBaseline {baseline['median_ms']:.0f} ms (Python {baseline['python']}), budget {budget:.0f} ms")
+    if budget is None:
+        print("\nNo baseline recorded; run with --record to set one")
+    elif median > budget:
+        print(f"\nFAIL: median import time {median:.0f} ms is over the {budget:.0f} ms budget")
+        failed = True
+    elif not failed:
+        print(f"\nOK: within the {budget:.0f} ms budget")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how long importing the app takes")
+    parser.add_argument("--runs", type=int, default=5)
+    budget_ms = os.environ.get('STARTUP_IMPORT_BUDGET_MS')
+    parser.add_argument("--budget-ms", type=float, default=float(budget_ms) if budget_ms else None,
+                        help="absolute budget, instead of the baseline plus tolerance")
+    parser.add_argument("--baseline", default=str(BASELINE))
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown over the baseline")
+    parser.add_argument("--record", action="store_true", help="write this run's median as the new baseline")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,122 @@
+"""Aggregation-pipeline updates for cart documents.
+
+Each cart mutation is a list of pipeline stages applied by a single
+``find_one_and_update``, so the server changes the cart atomically and
+concurrent taps from the app can never overwrite each other's quantities.
+User-supplied values are wrapped in ``$literal`` so that ids beginning with
+``$`` are never evaluated as field paths.
+
+Updates return the cart as it was before, and ``apply_ops`` replays the same
+operations on it in Python. Since the pipeline ran on exactly that document,
+the replay is the stored result, and ``line_changes`` can size stock
+reservations from the two without a separate, racy read.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# ("increment" | "set" | "remove", product_id, quantity), as in a cart PATCH
+Op = Tuple[str, str, int]
+STALE_FIELDS = ["total", "previous_items"]
+
+_LINES = {"$ifNull": ["$items", []]}
+
+
+def _has_line(product_id: str) -> dict:
+    return {"$in": [{"$literal": product_id}, {"$ifNull": ["$items.product_id", []]}]}
+
+
+def _upsert_line(product_id: str, quantity_expr, initial_quantity: int) -> List[dict]:
+    """Rewrite the matching line's quantity with ``quantity_expr`` or append a new line."""
+    return [{"$set": {"items": {"$cond": [
+        _has_line(product_id),
+        {"$map": {"input": _LINES, "as": "line", "in": {"$cond": [
+            {"$eq": ["$$line.product_id", {"$literal": product_id}]},
+            {"product_id": "$$line.product_id", "quantity": quantity_expr},
+            "$$line",
+        ]}}},
+        {"$concatArrays": [_LINES, {"$literal": [{"product_id": product_id, "quantity": initial_quantity}]}]},
+    ]}}}]
+
+
+def line_changes(previous: Optional[dict], cart: dict) -> Dict[str, int]:
+    """Quantity change per product between two versions of a cart."""
+    before = {line["product_id"]: line["quantity"] for line in (previous or {}).get("items") or []}
+    after = {line["product_id"]: line["quantity"] for line in cart.get("items", [])}
+    return {
+        product_id: after.get(product_id, 0) - before.get(product_id, 0)
+        for product_id in before.keys() | after.keys()
+        if after.get(product_id, 0) != before.get(product_id, 0)
+    }
+
+
+def increment_line(product_id: str, quantity: int) -> List[dict]:
+    return _upsert_line(product_id, {"$add": ["$$line.quantity", {"$literal": quantity}]}, quantity)
+
+
+def set_line(product_id: str, quantity: int) -> List[dict]:
+    return _upsert_line(product_id, {"$literal": quantity}, quantity)
+
+
+def remove_line(product_id: str) -> List[dict]:
+    return [{"$set": {"items": {"$filter": {
+        "input": _LINES, "as": "line",
+        "cond": {"$ne": ["$$line.product_id", {"$literal": product_id}]},
+    }}}}]
+
+
+def clear_lines() -> List[dict]:
+    return [{"$set": {"items": []}}]
+
+
+def op_stages(ops: List[Op]) -> List[dict]:
+    builders = {"increment": increment_line, "set": set_line}
+    stages = []
+    for op, product_id, quantity in ops:
+        stages += remove_line(product_id) if op == "remove" else builders[op](product_id, quantity)
+    return stages
+
+
+def apply_ops(cart: Optional[dict], user_id: str, ops: List[Op], cart_id: str, version: str,
+              updated_at: datetime) -> dict:
+    """The cart that ``op_stages(ops) + finalize(...)`` makes of ``cart`` (None: upserted)."""
+    cart = dict(cart or {"user_id": user_id})
+    lines = [dict(line) for line in cart.get("items") or []]
+    for op, product_id, quantity in ops:
+        if op == "remove":
+            lines = [line for line in lines if line["product_id"] != product_id]
+            continue
+        matching = [line for line in lines if line["product_id"] == product_id]
+        for line in matching:
+            line["quantity"] = line["quantity"] + quantity if op == "increment" else quantity
+        if not matching:
+            lines.append({"product_id": product_id, "quantity": quantity})
+    cart["items"] = [
+        {"product_id": line["product_id"], "quantity": line["quantity"]} for line in lines if line["quantity"] > 0
+    ]
+    if cart.get("id") is None:
+        cart["id"] = cart_id
+    cart["item_count"] = sum(line["quantity"] for line in cart["items"])
+    cart["version"] = version
+    cart["updated_at"] = updated_at
+    for field in STALE_FIELDS:
+        cart.pop(field, None)
+    return cart
+
+
+def finalize(cart_id: str, version: str, updated_at: datetime) -> List[dict]:
+    """Compact lines, drop empty ones and maintain the derived fields and version."""
+    return [
+        {"$set": {"items": {"$map": {
+            "input": {"$filter": {"input": _LINES, "as": "line", "cond": {"$gt": ["$$line.quantity", 0]}}},
+            "as": "line",
+            "in": {"product_id": "$$line.product_id", "quantity": "$$line.quantity"},
+        }}}},
+        {"$set": {
+            "id": {"$ifNull": ["$id", {"$literal": cart_id}]},
+            "item_count": {"$sum": "$items.quantity"},
+            "version": {"$literal": version},
+            "updated_at": updated_at,
+        }},
+        # Left over from older cart formats
+        {"$unset": STALE_FIELDS},
+    ]
@@ -0,0 +1,183 @@
+"""Read-through cache for categories and per-category product lists.
+
+Every watched collection has a version counter in ``catalog_versions``.
+Whatever edits products or categories (seed.py, migrate_images.py, an admin
+tool) calls ``bump_versions`` afterwards, and every worker derives the same
+opaque version stamp from the counter, so it can be used directly in an
+ETag. Workers watch the counters with a change stream, or on a standalone
+mongod (no oplog) poll them, which is one ``_id`` lookup per interval.
+
+Change stream events on the collections themselves only drop entries and
+feed the listeners (e.g. the search index) ahead of the bump. Stock is left
+out: ``stok`` moves with every checkout and cancel, is checked live where it
+matters, and shows up in cached listings at the next catalog change.
+"""
+import asyncio
+import hashlib
+import logging
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+WATCHED_COLLECTIONS = ("categories", "products")
+VERSIONS_COLLECTION = "catalog_versions"
+PRODUCT_LIST_PROJECTION = {"_id": 0}
+# Updates touching only these fields don't count as catalog changes
+STOCK_FIELDS = {"stok"}
+
+
+def _stamp(value: str) -> str:
+    return hashlib.sha1(value.encode()).hexdigest()[:16]
+
+
+async def bump_versions(db, collections: Iterable[str] = WATCHED_COLLECTIONS):
+    """Record that ``collections`` changed; every worker moves to the new version."""
+    for name in collections:
+        await db[VERSIONS_COLLECTION].update_one({"_id": name}, {"$inc": {"counter": 1}}, upsert=True)
+
+
+def _stock_only(change: dict) -> bool:
+    if change.get("operationType") != "update":
+        return False
+    description = change.get("updateDescription") or {}
+    fields = set(description.get("updatedFields") or {}) | set(description.get("removedFields") or [])
+    return bool(fields) and fields <= STOCK_FIELDS
+
+
+class CatalogCache:
+    def __init__(self, db, poll_interval: float = 30.0, max_categories: int = 256):
+        self.db = db
+        self.poll_interval = poll_interval
+        self.mode = "stopped"
+        self._versions: Dict[str, str] = {name: _stamp(str(uuid.uuid4())) for name in WATCHED_COLLECTIONS}
+        self._categories: Optional[List[dict]] = None
+        self._by_category = TTLCache(maxsize=max_categories, ttl=float("inf"))
+        self._listeners: List[Callable[[str, Optional[dict]], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        # Bumped on every invalidation, which doesn't always move the version
+        self._generations: Dict[str, int] = {name: 0 for name in WATCHED_COLLECTIONS}
+
+    # Versions and invalidation
+
+    def version(self, collection: str) -> str:
+        return self._versions[collection]
+
+    def on_invalidate(self, listener: Callable[[str, Optional[dict]], None]):
+        """Register ``listener(collection, change)`` to run whenever a watched collection changes.
+
+        ``change`` is the change-stream event, or None when only the fact that
+        the collection changed is known (a version bump).
+        """
+        self._listeners.append(listener)
+
+    def invalidate(self, collection: str, version: str, change: Optional[dict] = None, initial: bool = False):
+        self._versions[collection] = version
+        self._generations[collection] += 1
+        if collection == "categories":
+            self._categories = None
+        elif collection == "products":
+            self._by_category.clear()
+        # The first sync after start() only establishes versions; nothing changed yet
+        if initial:
+            return
+        for listener in self._listeners:
+            listener(collection, change)
+
+    # Read-through accessors
+
+    async def get_categories(self) -> List[dict]:
+        categories = self._categories
+        if categories is None:
+            generation = self._generations["categories"]
+            categories = await self.db.categories.find({}, {"_id": 0}).sort("nama", 1).to_list(1000)
+            # Don't store a result that raced with an invalidation
+            if generation == self._generations["categories"]:
+                self._categories = categories
+        return categories
+
+    async def get_products_by_category(self, category_name: str) -> List[dict]:
+        products = self._by_category.get(category_name)
+        if products is None:
+            generation = self._generations["products"]
+            products = await self.db.products.find({"kategori": category_name}, PRODUCT_LIST_PROJECTION).to_list(1000)
+            if generation == self._generations["products"]:
+                self._by_category.set(category_name, products)
+        return products
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "versions": dict(self._versions),
+            "categories_cached": self._categories is not None,
+            "by_category": self._by_category.stats(),
+        }
+
+    # Change detection
+
+    async def start(self):
+        # Versions before the first request, so a fresh worker's ETags match the others'
+        try:
+            self._apply_counters(await self._counters(), initial=True)
+        except PyMongoError as e:
+            logger.warning("Reading catalog versions failed: %s", e)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.mode = "stopped"
+
+    async def _counters(self) -> Dict[str, int]:
+        counters = {name: 0 for name in WATCHED_COLLECTIONS}
+        async for document in self.db[VERSIONS_COLLECTION].find({"_id": {"$in": list(WATCHED_COLLECTIONS)}}):
+            counters[document["_id"]] = document.get("counter", 0)
+        return counters
+
+    def _apply_counters(self, counters: Dict[str, int], initial: bool = False):
+        for name, counter in counters.items():
+            version = _stamp(f"{name}:{counter}")
+            if version != self._versions[name]:
+                self.invalidate(name, version, initial=initial)
+
+    async def _run(self):
+        try:
+            await self._watch()
+        except OperationFailure as e:
+            # Change streams need a replica set; standalone mongod reports an error here
+            logger.info("Change streams unavailable (%s), polling every %ss", e, self.poll_interval)
+        except PyMongoError as e:
+            logger.warning("Change stream failed (%s), polling every %ss", e, self.poll_interval)
+        await self._poll()
+
+    async def _watch(self):
+        names = [*WATCHED_COLLECTIONS, VERSIONS_COLLECTION]
+        async with self.db.watch([{"$match": {"ns.coll": {"$in": names}}}], full_document="updateLookup") as stream:
+            # Opening the stream marks "as of now"; a bump since start() is picked up here
+            await stream.try_next()
+            self._apply_counters(await self._counters())
+            self.mode = "change_stream"
+            async for change in stream:
+                name = change["ns"]["coll"]
+                if name == VERSIONS_COLLECTION:
+                    self._apply_counters(await self._counters())
+                elif not _stock_only(change):
+                    # Drop entries now; the version moves with the writer's bump
+                    self.invalidate(name, self._versions[name], change)
+
+    async def _poll(self):
+        self.mode = "polling"
+        while True:
+            try:
+                self._apply_counters(await self._counters())
+            except PyMongoError as e:
+                logger.warning("Reading catalog versions failed: %s", e)
+            await asyncio.sleep(self.poll_interval)
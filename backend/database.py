@@ -0,0 +1,72 @@
+"""MongoDB client lifecycle.
+
+``MongoConnection`` holds the URL and pool options. The Motor client itself
+is only created by ``open()``, which the app's lifespan calls. Importing
+server.py therefore creates no client. Services built at import time are
+handed a ``DatabaseProxy``, which forwards to the database once it is open.
+
+``warm_up`` checks out several connections at once, so the pool holds them
+before the worker takes traffic. Otherwise the first requests after a deploy
+would pay for the TCP and auth handshakes.
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+logger = logging.getLogger(__name__)
+
+
+class MongoConnection:
+    def __init__(self, url: str, db_name: str, **client_options):
+        self.url = url
+        self.db_name = db_name
+        self.client_options = client_options
+        self.client: Optional[AsyncIOMotorClient] = None
+        self._database = None
+        self.warmed_up = False
+
+    @property
+    def database(self):
+        if self._database is None:
+            raise RuntimeError("MongoDB client is not open")
+        return self._database
+
+    def open(self):
+        self.client = AsyncIOMotorClient(self.url, **self.client_options)
+        self._database = self.client[self.db_name]
+
+    async def warm_up(self, connections: int):
+        started = time.perf_counter()
+        # Concurrent commands each need their own connection, so this fills the pool
+        await asyncio.gather(*(self.client.admin.command("ping") for _ in range(max(connections, 1))))
+        self.warmed_up = True
+        logger.info("MongoDB pool warmed up with %d connections in %.0f ms", connections, (time.perf_counter() - started) * 1000)
+
+    async def ping(self, timeout: float) -> float:
+        """Round-trip time of a ping in seconds, including the wait for a pooled connection."""
+        started = time.perf_counter()
+        await asyncio.wait_for(self.client.admin.command("ping"), timeout)
+        return time.perf_counter() - started
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        self.client = None
+        self._database = None
+        self.warmed_up = False
+
+
+class DatabaseProxy:
+    """Stands in for the database before ``open()``; attribute and item access go to the open one."""
+
+    def __init__(self, connection: MongoConnection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection.database, name)
+
+    def __getitem__(self, name):
+        return self._connection.database[name]
@@ -0,0 +1,204 @@
+"""Opt-in fast JSON path for list endpoints.
+
+By default a handler builds a Pydantic model for every Mongo document. FastAPI
+then validates the result again against ``response_model`` and encodes it
+with the stdlib ``json`` module. ``FastSerializer`` skips both steps. It
+compiles each model's fields once into a whitelist of (name, converter,
+default) entries, applies the same numeric coercions Pydantic would, and
+encodes the raw documents with orjson. orjson and ``repr`` agree on floats
+between 1e-4 and 1e16; outside that range orjson writes exponents
+differently (``1e16`` for ``1e+16``), so those floats are pre-encoded with
+``repr``.
+
+Running this module checks that the fast path is byte-for-byte identical to
+the model path for the API's response models:
+
+    python fast_json.py          # synthetic edge cases
+    python fast_json.py --db     # plus every product and category in the database
+"""
+import math
+from datetime import datetime
+from typing import Any, Callable, Iterable, List, Optional, Tuple, Type, Union, get_args, get_origin
+
+import orjson
+from pydantic import BaseModel
+from pydantic_core import PydanticUndefined
+from starlette.responses import Response
+
+_MISSING = object()
+
+
+def _identity(value):
+    return value
+
+
+def _to_float(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError(f"Expected a number, got {value!r}")
+    value = float(value)
+    if value and not 1e-4 <= abs(value) < 1e16 and math.isfinite(value):
+        return orjson.Fragment(repr(value).encode())
+    return value
+
+
+def _to_int(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    raise TypeError(f"Expected an integer, got {value!r}")
+
+
+def _converter(annotation) -> Callable[[Any], Any]:
+    optional = False
+    if get_origin(annotation) is Union:
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        optional = len(args) < len(get_args(annotation))
+        annotation = args[0] if len(args) == 1 else Any
+    convert = {float: _to_float, int: _to_int}.get(annotation, _identity)
+    if optional and convert is not _identity:
+        return lambda value: None if value is None else convert(value)
+    return convert
+
+
+class FastSerializer:
+    def __init__(self, model: Type[BaseModel], exclude_unset: bool = False):
+        self.model = model
+        self.exclude_unset = exclude_unset
+        self._fields: List[Tuple[str, Callable, Any, Optional[Callable]]] = []
+        for name, field in model.model_fields.items():
+            default = _MISSING if field.default is PydanticUndefined else field.default
+            self._fields.append((name, _converter(field.annotation), default, field.default_factory))
+
+    def to_dict(self, doc: dict) -> dict:
+        out = {}
+        for name, convert, default, factory in self._fields:
+            value = doc.get(name, _MISSING)
+            if value is _MISSING:
+                if self.exclude_unset:
+                    continue
+                if factory is not None:
+                    value = factory()
+                elif default is _MISSING:
+                    raise KeyError(f"{self.model.__name__}.{name} is required")
+                else:
+                    value = default
+            out[name] = convert(value)
+        return out
+
+    def dumps(self, doc: dict) -> bytes:
+        return orjson.dumps(self.to_dict(doc), option=orjson.OPT_UTC_Z)
+
+    def dumps_list(self, docs: Iterable[dict]) -> bytes:
+        return orjson.dumps([self.to_dict(doc) for doc in docs], option=orjson.OPT_UTC_Z)
+
+
+def dumps(content: Any) -> bytes:
+    """Encode already-serialized content (e.g. several ``to_dict`` results) the same way."""
+    return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+
+
+class FastJSONResponse(Response):
+    """Response for bodies that are already encoded by ``FastSerializer``."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return content
+
+
+def model_path_bytes(model: Type[BaseModel], docs: List[dict], exclude_unset: bool = False) -> bytes:
+    """Encode ``docs`` the way a handler returning ``List[model]`` does today."""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    content = [model(**doc).model_dump(mode="json", exclude_unset=exclude_unset) for doc in docs]
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def find_mismatches(serializer: FastSerializer, docs: List[dict]) -> List[Tuple[dict, bytes, bytes]]:
+    mismatches = []
+    for doc in docs:
+        expected = model_path_bytes(serializer.model, [doc], serializer.exclude_unset)
+        actual = serializer.dumps_list([doc])
+        if expected != actual:
+            mismatches.append((doc, expected, actual))
+    return mismatches
+
+
+def _edge_case_products() -> List[dict]:
+    base = {
+        "id": "p-1", "nama": "Kopi Arabika", "deskripsi": "Biji kopi pilihan",
+        "harga": 150000.0, "gambar": "/api/images/" + "0" * 64, "kategori": "Makanan",
+        "stok": 10, "created_at": datetime(2025, 1, 1, 8, 30, 0, 123000),
+    }
+    return [
+        base,
+        {**base, "harga": 150000},  # integer price stored by another client
+        {**base, "harga": 0.1 + 0.2, "stok": 3.0},
+        {**base, "created_at": datetime(2025, 1, 1)},
+        {**base, "nama": "Kaos \"Gogama\" \\ edisi\n2025 — ukuran L \U0001f600 \x1f"},
+        {**base, "deskripsi": "<script>alert('x')</script> &  "},
+        {**base, "harga": math.pi * 1e6},
+        # Where orjson and repr format floats differently
+        {**base, "harga": 1e16},
+        {**base, "harga": 1.5e300},
+        {**base, "harga": 123456789012345678},
+        {**base, "harga": 1e-7},
+        {**base, "harga": 1e-5},
+        {**base, "harga": 5e-324},
+        {**base, "harga": -2.5e-10},
+        {**base, "harga": 9999999999999998.0},
+        {**base, "harga": 0.0001},
+        {**base, "harga": -0.0},
+        {key: value for key, value in base.items() if key != "stok"},  # default applies
+    ]
+
+
+def main(use_db: bool) -> int:
+    import asyncio
+
+    import server
+
+    products = _edge_case_products()
+    categories = [
+        {"id": "c-1", "nama": "Elektronik", "created_at": datetime(2025, 1, 1)},
+        {"id": "c-2", "nama": "Fashion", "gambar": None, "created_at": datetime(2025, 1, 1, 0, 0, 1, 5000)},
+    ]
+    if use_db:
+        async def load():
+            # Outside the app's lifespan, so open (and close) the client here
+            server.open_database()
+            try:
+                return (
+                    await server.db.products.find({}, {"_id": 0}).to_list(None),
+                    await server.db.categories.find({}, {"_id": 0}).to_list(None),
+                )
+            finally:
+                server.mongo.close()
+        db_products, db_categories = asyncio.run(load())
+        products += db_products
+        categories += db_categories
+
+    checks = [
+        (server.PRODUCT_JSON, products),
+        (server.PRODUCT_FIELDS_JSON, products + [{"id": doc["id"], "nama": doc["nama"]} for doc in products]),
+        (server.CATEGORY_JSON, categories),
+    ]
+    failed = 0
+    for serializer, docs in checks:
+        mismatches = find_mismatches(serializer, docs)
+        print(f"{serializer.model.__name__}: {len(docs) - len(mismatches)}/{len(docs)} byte-identical")
+        for doc, expected, actual in mismatches:
+            print(f"  {doc.get('id')}:\n    model: {expected!r}\n    fast:  {actual!r}")
+        failed += len(mismatches)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Compare the fast JSON path against the Pydantic models")
+    parser.add_argument("--db", action="store_true", help="also compare every product and category in the database")
+    sys.exit(main(parser.parse_args().db))
@@ -0,0 +1,110 @@
+"""Bounded executor for bcrypt password hashing.
+
+bcrypt is deliberately slow (hundreds of milliseconds per call), so running it
+inside an ``async def`` handler stalls the event loop for every other request.
+``PasswordHasher`` pushes the work onto a dedicated thread or process pool,
+caps the number of outstanding jobs and reports its queue depth.
+"""
+import asyncio
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+
+class HasherSaturated(Exception):
+    """Raised when the hashing queue is full and the caller should back off."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Password hashing queue is full")
+        self.retry_after = retry_after
+
+
+@lru_cache(maxsize=None)
+def _context(rounds: int) -> "CryptContext":
+    # Imported here so passlib and bcrypt load with the first hash, not with the worker
+    from passlib.context import CryptContext
+
+    # Pinning min/max rounds to the configured cost makes passlib flag any hash
+    # created with a different cost as needing an update.
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+# Module-level so they can be pickled into a ProcessPoolExecutor.
+def _hash(password: str, rounds: int) -> str:
+    return _context(rounds).hash(password)
+
+
+def _verify_and_update(password: str, hashed: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    return _context(rounds).verify_and_update(password, hashed)
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = 12, workers: int = 2, max_pending: int = 64,
+                 mode: str = "thread", retry_after: int = 1):
+        if mode == "process":
+            self._executor: Executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.mode = mode
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._rehashed = 0
+
+    async def _submit(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise HasherSaturated(self.retry_after)
+            self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password, self.rounds)
+
+    async def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """Verify ``password`` and return a replacement hash if the stored cost is stale."""
+        valid, new_hash = await self._submit(_verify_and_update, password, hashed, self.rounds)
+        if new_hash:
+            with self._lock:
+                self._rehashed += 1
+        return valid, new_hash
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = self._pending
+            return {
+                "mode": self.mode,
+                "rounds": self.rounds,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "in_flight": min(pending, self.workers),
+                "queue_depth": max(pending - self.workers, 0),
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "rehashed": self._rehashed,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,212 @@
+"""Content-addressed storage for product and category images.
+
+Images are keyed by the SHA-256 of their bytes, so identical uploads share one
+blob and the URL of an image never changes. Thumbnails for ``thumbnail_sizes``
+are generated once, when the original is stored.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZES = (64, 256, 512)
+IMAGE_URL_PREFIX = "/api/images/"
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def parse_data_uri(value: str) -> Tuple[bytes, str]:
+    header, _, payload = value.partition(",")
+    if not header.startswith("data:") or not header.endswith(";base64"):
+        raise InvalidImage("Expected a base64 data URI")
+    content_type = header[len("data:"):-len(";base64")] or "application/octet-stream"
+    try:
+        return base64.b64decode(payload, validate=True), content_type
+    except binascii.Error as e:
+        raise InvalidImage(str(e))
+
+
+def image_url(digest: str) -> str:
+    return IMAGE_URL_PREFIX + digest
+
+
+def thumbnail_url(url: str, size: int) -> str:
+    """Point a stored image URL at one of its pre-generated thumbnails."""
+    if url and url.startswith(IMAGE_URL_PREFIX):
+        return f"{url}?size={size}"
+    return url
+
+
+def make_thumbnail(data: bytes, size: int) -> Tuple[bytes, str]:
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        img.thumbnail((size, size))
+        if img.mode in ("RGBA", "LA", "P"):
+            fmt, content_type = "PNG", "image/png"
+        else:
+            img = img.convert("RGB")
+            fmt, content_type = "JPEG", "image/jpeg"
+        out = io.BytesIO()
+        img.save(out, fmt, optimize=True)
+    return out.getvalue(), content_type
+
+
+def parse_range(header: str, length: int) -> Optional[Tuple[int, int]]:
+    """Parse a single ``bytes=`` range; returns inclusive (start, end) or None if unsatisfiable."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start_s, _, end_s = spec.strip().partition("-")
+    try:
+        if start_s:
+            start = int(start_s)
+            end = int(end_s) if end_s else length - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(length - int(end_s), 0)
+            end = length - 1
+    except ValueError:
+        return None
+    end = min(end, length - 1)
+    if start > end or start >= length:
+        return None
+    return start, end
+
+
+class ImageStore:
+    """Base class; backends implement ``_exists``, ``_read`` and ``_write``."""
+
+    def __init__(self, thumbnail_sizes: Sequence[int] = THUMBNAIL_SIZES):
+        self.thumbnail_sizes = tuple(thumbnail_sizes)
+
+    async def put(self, data: bytes, content_type: str) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        if await self._exists(digest, None):
+            return digest
+        loop = asyncio.get_running_loop()
+        for size in self.thumbnail_sizes:
+            try:
+                thumb, thumb_type = await loop.run_in_executor(None, make_thumbnail, data, size)
+            except Exception as e:
+                # Undecodable formats (e.g. SVG) are served at their original size
+                logger.warning("Skipping %spx thumbnail for %s: %s", size, digest, e)
+                break
+            await self._write(digest, size, thumb, thumb_type)
+        # The original is written last so its presence means the image is complete
+        await self._write(digest, None, data, content_type)
+        return digest
+
+    async def put_data_uri(self, value: str) -> str:
+        data, content_type = parse_data_uri(value)
+        return await self.put(data, content_type)
+
+    async def get(self, digest: str, size: Optional[int] = None) -> Optional[Tuple[bytes, str]]:
+        if size is not None:
+            blob = await self._read(digest, size)
+            if blob is not None:
+                return blob
+        return await self._read(digest, None)
+
+    async def _exists(self, digest: str, size: Optional[int]) -> bool:
+        raise NotImplementedError
+
+    async def _read(self, digest: str, size: Optional[int]) -> Optional[Tuple[bytes, str]]:
+        raise NotImplementedError
+
+    async def _write(self, digest: str, size: Optional[int], data: bytes, content_type: str):
+        raise NotImplementedError
+
+
+class LocalImageStore(ImageStore):
+    """Stores blobs under ``root/<ab>/<digest>/<variant>`` with a ``.type`` sidecar."""
+
+    def __init__(self, root, thumbnail_sizes: Sequence[int] = THUMBNAIL_SIZES):
+        super().__init__(thumbnail_sizes)
+        self.root = Path(root)
+
+    def _path(self, digest: str, size: Optional[int]) -> Path:
+        return self.root / digest[:2] / digest / (str(size) if size else "original")
+
+    async def _exists(self, digest, size):
+        return self._path(digest, size).exists()
+
+    async def _read(self, digest, size):
+        path = self._path(digest, size)
+
+        def read():
+            try:
+                return path.read_bytes(), path.with_suffix(".type").read_text()
+            except FileNotFoundError:
+                return None
+
+        return await asyncio.to_thread(read)
+
+    async def _write(self, digest, size, data, content_type):
+        path = self._path(digest, size)
+
+        def write():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.with_suffix(".type").write_text(content_type)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+
+        await asyncio.to_thread(write)
+
+
+class GridFSImageStore(ImageStore):
+    """Stores blobs in a GridFS bucket with filenames ``<digest>/<variant>``."""
+
+    def __init__(self, db, bucket_name: str = "images", thumbnail_sizes: Sequence[int] = THUMBNAIL_SIZES):
+        from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+        super().__init__(thumbnail_sizes)
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket_name)
+
+    @staticmethod
+    def _filename(digest: str, size: Optional[int]) -> str:
+        return f"{digest}/{size or 'original'}"
+
+    async def _find(self, digest, size):
+        files = await self.bucket.find({"filename": self._filename(digest, size)}).limit(1).to_list(1)
+        return files[0] if files else None
+
+    async def _exists(self, digest, size):
+        return await self._find(digest, size) is not None
+
+    async def _read(self, digest, size):
+        file = await self._find(digest, size)
+        if file is None:
+            return None
+        stream = await self.bucket.open_download_stream(file._id)
+        return await stream.read(), (file.metadata or {}).get("contentType", "application/octet-stream")
+
+    async def _write(self, digest, size, data, content_type):
+        await self.bucket.upload_from_stream(
+            self._filename(digest, size), data, metadata={"contentType": content_type}
+        )
+
+
+def create_image_store(db, backend: str = "local", path=None) -> ImageStore:
+    if backend == "gridfs":
+        return GridFSImageStore(db)
+    return LocalImageStore(path or Path(__file__).parent / "media")
+
+
+async def externalize_image(store: ImageStore, value: Optional[str]) -> Optional[str]:
+    """Replace a base64 data URI with its image URL; other values pass through."""
+    if not value or not value.startswith("data:"):
+        return value
+    return image_url(await store.put_data_uri(value))
@@ -0,0 +1,210 @@
+"""MongoDB index definitions and query-plan diagnostics.
+
+``create_indexes`` is idempotent and runs once per deploy, from serve.py or
+seed.py, before any worker starts. Workers only check with
+``missing_indexes`` and report unready until everything exists. Running this
+module directly creates the indexes, and can check every query shape the API
+issues with ``explain()``:
+
+    python indexes.py            # create indexes
+    python indexes.py --explain  # create indexes, then fail on any COLLSCAN
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_HISTORY_TTL = 7 * 24 * 3600
+CART_EVENT_TTL = 30 * 24 * 3600
+
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    ],
+    "products": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+        IndexModel([("kategori", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="kategori_created_at_id"),
+        IndexModel([("nama", ASCENDING)], name="nama"),
+    ],
+    "categories": [
+        IndexModel([("nama", ASCENDING)], unique=True, name="nama_unique"),
+    ],
+    "carts": [
+        IndexModel([("user_id", ASCENDING)], unique=True, name="user_id_unique"),
+    ],
+    "orders": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="user_id_created_at_id"),
+        IndexModel(
+            [("user_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="user_id_status_created_at_id",
+        ),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+    ],
+    "stock_reservations": [
+        IndexModel(
+            [("user_id", ASCENDING), ("product_id", ASCENDING)],
+            unique=True, partialFilterExpression={"status": "active"}, name="user_id_product_id_active",
+        ),
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)], name="status_expires_at"),
+        # Finished reservations only; active ones have no released_at
+        IndexModel([("released_at", ASCENDING)], expireAfterSeconds=RESERVATION_HISTORY_TTL, name="released_at_ttl"),
+    ],
+    "reserved_stock": [
+        IndexModel([("quantity", ASCENDING)], name="quantity"),
+    ],
+    "brands": [
+        IndexModel([("nama", ASCENDING)], name="nama"),
+    ],
+    "promotions": [
+        IndexModel([("active", ASCENDING), ("endDate", ASCENDING)], name="active_endDate"),
+    ],
+    "cart_events": [
+        IndexModel([("at", ASCENDING)], expireAfterSeconds=CART_EVENT_TTL, name="at_ttl"),
+    ],
+    # A revocation only matters until the token would have expired anyway
+    "revoked_tokens": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+        IndexModel([("revoked_at", ASCENDING)], name="revoked_at"),
+    ],
+    # Spent tokens stay until expiry so a replayed one can still be recognised
+    "refresh_tokens": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+        IndexModel([("family", ASCENDING)], name="family"),
+    ],
+    # $out keeps the target collection's indexes when it replaces the ranking
+    "trending_products": [
+        IndexModel([("score", DESCENDING), ("product_id", ASCENDING)], name="score_product_id"),
+    ],
+}
+
+_SAMPLE_DATE = datetime(2025, 1, 1)
+
+# (collection, filter, sort) for every query the API issues
+QUERY_SHAPES = [
+    ("users", {"email": "user@example.com"}, None),
+    ("users", {"id": "user-id"}, None),
+    ("products", {"id": "product-id"}, None),
+    ("products", {"id": {"$in": ["product-a", "product-b"]}}, None),
+    ("products", {"nama": "Produk"}, None),
+    ("products", {"kategori": "Elektronik"}, None),
+    ("products", {}, [("created_at", ASCENDING), ("id", ASCENDING)]),
+    ("products", {"$or": [
+        {"created_at": {"$gt": _SAMPLE_DATE}},
+        {"created_at": _SAMPLE_DATE, "id": {"$gt": "product-id"}},
+    ]}, [("created_at", ASCENDING), ("id", ASCENDING)]),
+    ("categories", {}, [("nama", ASCENDING)]),
+    ("categories", {"nama": "Elektronik"}, None),
+    ("catalog_versions", {"_id": {"$in": ["categories", "products"]}}, None),
+    ("carts", {"user_id": "user-id"}, None),
+    ("orders", {"id": "order-id", "user_id": "user-id"}, None),
+    ("orders", {"user_id": "user-id"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("orders", {"user_id": "user-id", "$or": [
+        {"created_at": {"$lt": _SAMPLE_DATE}},
+        {"created_at": _SAMPLE_DATE, "id": {"$lt": "order-id"}},
+    ]}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("orders", {"user_id": "user-id", "status": {"$in": ["pending", "confirmed"]}},
+     [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("orders", {"id": "order-id", "user_id": "user-id", "status": "pending"}, None),
+    ("stock_reservations", {"user_id": "user-id", "product_id": "product-id", "status": "active"}, None),
+    ("stock_reservations", {"user_id": "user-id", "product_id": {"$in": ["product-a", "product-b"]}, "status": "active"}, None),
+    ("stock_reservations", {"user_id": "user-id", "status": "active"}, None),
+    ("stock_reservations", {"status": "active", "expires_at": {"$lte": _SAMPLE_DATE}}, None),
+    ("stock_reservations", {"status": "active"}, None),
+    ("reserved_stock", {"quantity": {"$ne": 0}}, None),
+    ("orders", {"created_at": {"$gte": _SAMPLE_DATE}, "status": {"$ne": "cancelled"}}, None),
+    ("cart_events", {"at": {"$gte": _SAMPLE_DATE}}, None),
+    ("trending_products", {}, [("score", DESCENDING), ("product_id", ASCENDING)]),
+    ("products", {"id": {"$nin": ["product-a", "product-b"]}}, [("nama", ASCENDING)]),
+    ("products", {}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("banners", {}, [("_id", ASCENDING)]),
+    ("brands", {}, [("nama", ASCENDING)]),
+    ("promotions", {"active": True, "startDate": {"$lte": _SAMPLE_DATE}, "endDate": {"$gte": _SAMPLE_DATE}}, None),
+    ("revoked_tokens", {"expires_at": {"$gt": _SAMPLE_DATE}}, None),
+    ("revoked_tokens", {"revoked_at": {"$gte": _SAMPLE_DATE}}, None),
+    ("refresh_tokens", {"family": "family-id"}, None),
+]
+
+
+async def create_indexes(db):
+    for collection, models in INDEXES.items():
+        try:
+            await db[collection].create_indexes(models)
+        except OperationFailure as e:
+            # Usually duplicate data blocking a unique index; keep serving and report it
+            logger.error("Could not create indexes on %s: %s", collection, e)
+
+
+async def missing_indexes(db) -> Dict[str, List[str]]:
+    """Names of the indexes in ``INDEXES`` the database doesn't have, by collection."""
+    missing = {}
+    for collection, models in INDEXES.items():
+        existing = await db[collection].index_information()
+        names = [model.document["name"] for model in models if model.document["name"] not in existing]
+        if names:
+            missing[collection] = names
+    return missing
+
+
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+
+async def explain_query_shapes(db) -> list:
+    """Return ``(collection, filter, stages)`` for every shape whose winning plan is a COLLSCAN."""
+    failures = []
+    for collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = (await cursor.explain())["queryPlanner"]["winningPlan"]
+        stages = list(_plan_stages(plan))
+        logger.info("%s %s -> %s", collection, query, " <- ".join(stages))
+        if "COLLSCAN" in stages:
+            failures.append((collection, query, stages))
+    return failures
+
+
+async def main(explain: bool) -> int:
+    # Workers import this module for missing_indexes; only the CLI needs its own client
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        await create_indexes(db)
+        if not explain:
+            return 0
+        failures = await explain_query_shapes(db)
+        for collection, query, _ in failures:
+            logger.error("COLLSCAN: %s %s", collection, query)
+        return 1 if failures else 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Create MongoDB indexes and check query plans")
+    parser.add_argument("--explain", action="store_true", help="fail if any API query shape resolves to COLLSCAN")
+    sys.exit(asyncio.run(main(parser.parse_args().explain)))
@@ -0,0 +1,153 @@
+"""Cross-worker cache invalidation over a capped MongoDB collection.
+
+Each worker keeps its own in-process caches. When one worker changes
+something another may have cached, it publishes the cache name and key.
+Pending invalidations are batched into a single insert into the capped
+``cache_invalidations`` collection. Every worker tails that collection with
+a tailable cursor and drops the named entries from its own caches, skipping
+messages it sent itself.
+
+Tailable cursors work on a standalone mongod as well as on a replica set,
+unlike change streams. A worker whose cursor dies cannot tell what it missed,
+for instance when a slow reader lets the capped collection wrap past its
+position. It then clears every registered cache before resuming.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "cache_invalidations"
+# Messages are tiny; this holds tens of thousands of batches
+CAPPED_SIZE = 4 * 1024 * 1024
+# On (re)opening, replay messages this recent, so a batch written during the reopen isn't missed
+TAIL_OVERLAP = timedelta(seconds=2)
+
+
+class InvalidationBus:
+    def __init__(self, db, enabled: bool = True, retry_interval: float = 1.0):
+        self.db = db
+        self.enabled = enabled
+        self.retry_interval = retry_interval
+        self.worker_id = uuid.uuid4().hex
+        self.mode = "stopped"
+        self._caches: Dict[str, TTLCache] = {}
+        self._pending: List[Tuple[str, Optional[str]]] = []
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.published = 0
+        self.received = 0
+        self.resets = 0
+
+    def register(self, name: str, cache: TTLCache):
+        self._caches[name] = cache
+
+    def publish(self, name: str, key: Optional[str] = None):
+        """Tell the other workers to drop ``key`` (or everything, if None) from cache ``name``."""
+        if self.mode != "tailing":
+            return
+        self._pending.append((name, key))
+        self._wakeup.set()
+
+    def invalidate(self, name: str, key: Optional[str] = None):
+        """Drop the entry here and in every other worker."""
+        self._apply(name, key)
+        self.publish(name, key)
+
+    def _apply(self, name: str, key: Optional[str]):
+        cache = self._caches.get(name)
+        if cache is None:
+            return
+        if key is None:
+            cache.clear()
+        else:
+            cache.invalidate(key)
+
+    def _reset(self):
+        self.resets += 1
+        for cache in self._caches.values():
+            cache.clear()
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "worker_id": self.worker_id,
+            "caches": sorted(self._caches),
+            "published": self.published,
+            "received": self.received,
+            "resets": self.resets,
+        }
+
+    # Lifecycle
+
+    async def start(self):
+        if not self.enabled:
+            return
+        try:
+            await self.db.create_collection(COLLECTION, capped=True, size=CAPPED_SIZE)
+        except CollectionInvalid:
+            pass
+        # A tailable cursor on an empty capped collection is dead on arrival
+        await self.db[COLLECTION].insert_one({"origin": self.worker_id, "at": datetime.utcnow(), "entries": []})
+        self.mode = "tailing"
+        self._tasks = [asyncio.create_task(self._flush()), asyncio.create_task(self._tail())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self.mode = "stopped"
+
+    async def _flush(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # Everything published since the last insert goes out as one message
+            pending, self._pending = self._pending, []
+            try:
+                await self.db[COLLECTION].insert_one({
+                    "origin": self.worker_id,
+                    "at": datetime.utcnow(),
+                    "entries": [{"cache": name, "key": key} for name, key in pending],
+                })
+                self.published += len(pending)
+            except PyMongoError as e:
+                # Other workers may now serve stale entries until their TTL runs out
+                logger.warning("Publishing %d cache invalidations failed: %s", len(pending), e)
+
+    async def _tail(self):
+        first = True
+        while True:
+            since = datetime.utcnow() - TAIL_OVERLAP
+            if not first:
+                # Whatever was published while the cursor was down is lost
+                self._reset()
+            first = False
+            # No filter: a tailable query that matches nothing returns a dead cursor
+            cursor = self.db[COLLECTION].find({}, cursor_type=CursorType.TAILABLE_AWAIT)
+            try:
+                while cursor.alive:
+                    async for message in cursor:
+                        if message["origin"] == self.worker_id or message["at"] < since:
+                            continue
+                        for entry in message["entries"]:
+                            self._apply(entry["cache"], entry["key"])
+                        self.received += len(message["entries"])
+                    await asyncio.sleep(0.05)
+            except PyMongoError as e:
+                logger.warning("Cache invalidation cursor failed: %s", e)
+            finally:
+                await cursor.close()
+            await asyncio.sleep(self.retry_interval)
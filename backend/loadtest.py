@@ -0,0 +1,443 @@
+"""Load test and benchmark suite for the API.
+
+This script seeds a scratch database with a synthetic catalog and user base.
+It then runs concurrent virtual users through the app's main flow: log in,
+open home, browse, search, add to cart and sometimes check out. For every
+endpoint it reports requests per second and p50/p95/p99 latency. Results are
+written as JSON, so two runs can be compared for regressions.
+
+    python loadtest.py seed --products 100000 --users 100000
+    python loadtest.py run --boot --workers 4 --clients 200 --duration 60 --out after.json
+    python loadtest.py run --base-url http://localhost:8001 --skip-seed --out after.json
+    python loadtest.py run --mongomock --products 2000 --users 500 --clients 50 --duration 20
+    python loadtest.py compare before.json after.json --tolerance 0.15
+
+Data goes to ``<DB_NAME>_loadtest`` unless ``--db-name`` says otherwise.
+``--boot`` starts uvicorn against that database; with ``--base-url`` the
+server must already point at it. ``--mongomock`` runs the app in-process on
+mongomock-motor, which is handy without a mongod. It only measures the Python
+side, and background refreshers (change streams, trending, reservation
+sweeps) do not run.
+
+Needs httpx, plus mongomock-motor for ``--mongomock``.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = Path(__file__).parent
+PASSWORD = "loadtest-password"
+BATCH_SIZE = 10_000
+
+CATEGORIES = [
+    "Elektronik", "Fashion", "Makanan", "Kesehatan", "Kecantikan", "Olahraga", "Otomotif", "Buku",
+    "Mainan", "Rumah Tangga", "Perkakas", "Komputer", "Handphone", "Kamera", "Musik", "Minuman",
+    "Bayi", "Hewan Peliharaan", "Taman", "Alat Tulis",
+]
+WORDS = [
+    "kopi", "teh", "sepatu", "kaos", "celana", "jaket", "tas", "dompet", "jam", "kabel", "charger",
+    "lampu", "kipas", "panci", "wajan", "sabun", "sampo", "beras", "gula", "madu", "susu", "roti",
+    "bola", "raket", "helm", "ban", "oli", "buku", "pensil", "boneka", "laptop", "mouse", "keyboard",
+    "speaker", "headset", "kamera", "tripod", "gitar", "vitamin", "masker",
+]
+ADJECTIVES = ["premium", "murah", "original", "hitam", "putih", "merah", "besar", "kecil", "anak", "pria", "wanita"]
+
+CHECKOUT = {
+    "nama_penerima": "Load Test",
+    "alamat": "Jl. Pengujian No. 1",
+    "nomor_whatsapp": "081234567890",
+    "metode_pembayaran": "transfer",
+}
+
+
+def product_id(i: int) -> str:
+    return f"loadtest-product-{i}"
+
+
+def user_email(i: int) -> str:
+    return f"user{i}@loadtest.example.com"
+
+
+# Seeding
+
+async def _insert_batches(collection, docs, total: int):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == BATCH_SIZE:
+            await collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await collection.insert_many(batch, ordered=False)
+    logger.info("Inserted %d %s", total, collection.name)
+
+
+async def seed(db, image_store, products: int, users: int, rounds: int) -> dict:
+    """Replace the catalog, users and shopping data in ``db`` with synthetic data."""
+    from catalog_cache import bump_versions
+    from hashing import _hash
+    from image_store import externalize_image
+    from indexes import create_indexes
+    from seed import PLACEHOLDER_IMAGE
+
+    for name in ("users", "products", "categories", "carts", "orders", "stock_reservations",
+                 "cart_events", "trending_products"):
+        await db[name].drop()
+
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    gambar = await externalize_image(image_store, PLACEHOLDER_IMAGE)
+    # bcrypt is the slow part; every synthetic user shares one hash
+    password = _hash(PASSWORD, rounds)
+
+    await db.categories.insert_many([
+        {"id": f"loadtest-category-{i}", "nama": nama, "created_at": now} for i, nama in enumerate(CATEGORIES)
+    ])
+    await _insert_batches(db.products, (
+        {
+            "id": product_id(i),
+            "nama": f"{rng.choice(WORDS).title()} {rng.choice(ADJECTIVES)} {rng.choice(WORDS)} {i}",
+            "deskripsi": " ".join(rng.choice(WORDS + ADJECTIVES) for _ in range(12)),
+            "harga": float(rng.randrange(5_000, 5_000_000, 500)),
+            "gambar": gambar,
+            "kategori": rng.choice(CATEGORIES),
+            # Plenty of stock so checkout throughput isn't capped by sell-outs
+            "stok": 1_000_000,
+            "created_at": now - timedelta(seconds=products - i),
+        }
+        for i in range(products)
+    ), products)
+    await bump_versions(db)
+    await _insert_batches(db.users, (
+        {
+            "id": f"loadtest-user-{i}",
+            "nama_lengkap": f"Pengguna {i}",
+            "email": user_email(i),
+            "nomor_whatsapp": f"08{i:010d}",
+            "password": password,
+            "created_at": now,
+        }
+        for i in range(users)
+    ), users)
+    # Building indexes after the bulk load is much faster than maintaining them during it
+    await create_indexes(db)
+    return {"products": products, "users": users, "categories": len(CATEGORIES)}
+
+
+# Measurement
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.failures: Dict[str, int] = defaultdict(int)
+
+    async def request(self, client, name: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except Exception as e:
+            self.failures[name] += 1
+            logger.debug("%s failed: %s", name, e)
+            return None
+        self.latencies[name].append(time.perf_counter() - started)
+        self.statuses[name][response.status_code] += 1
+        return response
+
+    def summary(self, elapsed: float) -> dict:
+        endpoints = {}
+        for name in sorted(set(self.latencies) | set(self.failures)):
+            latencies = sorted(self.latencies[name])
+            statuses = self.statuses[name]
+            errors = sum(count for status, count in statuses.items() if status >= 400) + self.failures[name]
+            endpoints[name] = {
+                "requests": len(latencies) + self.failures[name],
+                "errors": errors,
+                "statuses": {str(status): count for status, count in sorted(statuses.items())},
+                "rps": len(latencies) / elapsed,
+                "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+            }
+        everything = sorted(latency for latencies in self.latencies.values() for latency in latencies)
+        total = {
+            "requests": sum(endpoint["requests"] for endpoint in endpoints.values()),
+            "errors": sum(endpoint["errors"] for endpoint in endpoints.values()),
+            "rps": len(everything) / elapsed,
+            "p50_ms": percentile(everything, 0.50) * 1000,
+            "p95_ms": percentile(everything, 0.95) * 1000,
+            "p99_ms": percentile(everything, 0.99) * 1000,
+        }
+        return {"elapsed": elapsed, "total": total, "endpoints": endpoints}
+
+
+# Flows
+
+async def shopper(client, recorder: Recorder, rng: random.Random, args, deadline: float):
+    """One virtual user: repeatedly log in as a random user and go shopping."""
+    while time.monotonic() < deadline:
+        response = await recorder.request(client, "POST /api/auth/login", "POST", "/api/auth/login",
+                                          json={"email": user_email(rng.randrange(args.users)), "password": PASSWORD})
+        if response is None or response.status_code != 200:
+            continue
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        await recorder.request(client, "GET /api/home", "GET", "/api/home", headers=headers)
+        cursor = None
+        for _ in range(rng.randint(1, 3)):
+            response = await recorder.request(client, "GET /api/products", "GET", "/api/products", headers=headers,
+                                              params={"limit": 20, **({"cursor": cursor} if cursor else {})})
+            cursor = response.headers.get("X-Next-Cursor") if response is not None else None
+            if not cursor:
+                break
+        await recorder.request(client, "GET /api/products/by-category/{name}", "GET",
+                               f"/api/products/by-category/{rng.choice(CATEGORIES)}", headers=headers)
+        await recorder.request(client, "GET /api/products/search", "GET", "/api/products/search", headers=headers,
+                               params={"q": f"{rng.choice(WORDS)} {rng.choice(ADJECTIVES)[:3]}"})
+
+        added = set()
+        for _ in range(rng.randint(1, 3)):
+            chosen = product_id(rng.randrange(args.products))
+            added.add(chosen)
+            await recorder.request(client, "GET /api/products/{id}", "GET", f"/api/products/{chosen}", headers=headers)
+            await recorder.request(client, "POST /api/cart/add", "POST", "/api/cart/add", headers=headers,
+                                   params={"product_id": chosen, "quantity": rng.randint(1, 2)})
+        await recorder.request(client, "GET /api/cart", "GET", "/api/cart", headers=headers)
+
+        if rng.random() < args.checkout_ratio:
+            await recorder.request(client, "POST /api/orders", "POST", "/api/orders", headers=headers, json=CHECKOUT)
+            await recorder.request(client, "GET /api/orders", "GET", "/api/orders", headers=headers)
+        else:
+            # Abandon the cart; emptying it also returns the reserved stock
+            await recorder.request(client, "PATCH /api/cart", "PATCH", "/api/cart", headers=headers,
+                                   json={"operations": [{"op": "remove", "product_id": chosen} for chosen in added]})
+
+
+async def drive(client, args) -> dict:
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        shopper(client, recorder, random.Random(seed), args, deadline) for seed in range(args.clients)
+    ))
+    return recorder.summary(time.perf_counter() - started)
+
+
+# Targets
+
+def boot_server(db_name: str, port: int, workers: int) -> subprocess.Popen:
+    env = {**os.environ, "DB_NAME": db_name}
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT_DIR, env=env,
+    )
+
+
+async def wait_until_up(client, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/api/status/hashing")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("Server did not come up")
+
+
+def in_process_server():
+    """Import the app with motor swapped for mongomock-motor."""
+    import mongomock_motor
+    import motor.motor_asyncio
+
+    # Must happen before server.py creates its client
+    motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+    import server
+
+    # No lifespan runs under ASGITransport, so open the (mocked) client here
+    server.open_database()
+    # mongomock has no "hello" command; behave like a standalone mongod
+    server._transactions_supported = False
+    # nor $unset stages in update pipelines; $project drops the fields the same way
+    import cart_updates
+    finalize = cart_updates.finalize
+    cart_updates.finalize = lambda *args: [
+        {"$project": {field: 0 for field in stage["$unset"]}} if "$unset" in stage else stage
+        for stage in finalize(*args)
+    ]
+    return server
+
+
+async def run(args) -> dict:
+    import httpx
+
+    from image_store import create_image_store
+
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    process = None
+    if args.mongomock:
+        server = in_process_server()
+        await seed(server.db, server.image_store, args.products, args.users, server.password_hasher.rounds)
+        await server.search_index.load(server.db)
+        await server.trending.load()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://loadtest",
+                                   limits=limits, timeout=args.timeout)
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        mongo = AsyncIOMotorClient(os.environ["MONGO_URL"])
+        try:
+            if not args.skip_seed:
+                db = mongo[args.db_name]
+                image_store = create_image_store(db, os.environ.get('IMAGE_STORE', 'local'), os.environ.get('IMAGE_STORE_PATH'))
+                await seed(db, image_store, args.products, args.users, int(os.environ.get('BCRYPT_ROUNDS', 12)))
+        finally:
+            mongo.close()
+        base_url = args.base_url
+        if args.boot:
+            process = boot_server(args.db_name, args.port, args.workers)
+            base_url = f"http://127.0.0.1:{args.port}"
+        client = httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout)
+
+    try:
+        await wait_until_up(client)
+        logger.info("Running %d clients for %ss", args.clients, args.duration)
+        result = await drive(client, args)
+    finally:
+        await client.aclose()
+        if process:
+            process.terminate()
+            process.wait()
+
+    result["meta"] = {
+        "started_at": datetime.utcnow().isoformat(),
+        "target": "mongomock" if args.mongomock else ("boot" if args.boot else args.base_url),
+        "workers": args.workers if args.boot else None,
+        "clients": args.clients,
+        "duration": args.duration,
+        "products": args.products,
+        "users": args.users,
+        "checkout_ratio": args.checkout_ratio,
+        "python": platform.python_version(),
+    }
+    return result
+
+
+# Reporting
+
+def print_summary(result: dict):
+    print(f"{'endpoint':40} {'requests':>9} {'errors':>7} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, endpoint in list(result["endpoints"].items()) + [("TOTAL", result["total"])]:
+        print(f"{name:40} {endpoint['requests']:>9} {endpoint['errors']:>7} {endpoint['rps']:>8.1f} "
+              f"{endpoint['p50_ms']:>8.1f} {endpoint['p95_ms']:>8.1f} {endpoint['p99_ms']:>8.1f}")
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> List[str]:
+    """Return a line for every endpoint whose p95 or throughput got worse by more than ``tolerance``."""
+    regressions = []
+    for name, before in sorted(baseline["endpoints"].items()):
+        after = current["endpoints"].get(name)
+        if after is None:
+            regressions.append(f"{name}: missing from current run")
+            continue
+        if before["p95_ms"] and after["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.1f} -> {after['p95_ms']:.1f} ms")
+        if before["rps"] and after["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {before['rps']:.1f} -> {after['rps']:.1f}")
+        if after["errors"] > before["errors"]:
+            regressions.append(f"{name}: errors {before['errors']} -> {after['errors']}")
+    return regressions
+
+
+async def seed_main(args) -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from image_store import create_image_store
+
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[args.db_name]
+    try:
+        image_store = create_image_store(db, os.environ.get('IMAGE_STORE', 'local'), os.environ.get('IMAGE_STORE_PATH'))
+        seeded = await seed(db, image_store, args.products, args.users, int(os.environ.get('BCRYPT_ROUNDS', 12)))
+        logger.info("Seeded %s into %s", seeded, args.db_name)
+    finally:
+        client.close()
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    load_dotenv(ROOT_DIR / '.env')
+    parser = argparse.ArgumentParser(description="Seed, load-test and compare API benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def data_options(command):
+        command.add_argument("--products", type=int, default=10_000, help="synthetic products (1k-1M)")
+        command.add_argument("--users", type=int, default=10_000, help="synthetic users (up to 100k)")
+        command.add_argument("--db-name", default=f"{os.environ.get('DB_NAME', 'gogama')}_loadtest")
+
+    seed_command = commands.add_parser("seed", help="load synthetic data into the scratch database")
+    data_options(seed_command)
+
+    run_command = commands.add_parser("run", help="drive concurrent shoppers and report latency")
+    data_options(run_command)
+    target = run_command.add_mutually_exclusive_group(required=True)
+    target.add_argument("--base-url", help="an already running server, e.g. http://localhost:8001")
+    target.add_argument("--boot", action="store_true", help="start uvicorn against the scratch database")
+    target.add_argument("--mongomock", action="store_true", help="run the app in-process on mongomock-motor")
+    run_command.add_argument("--skip-seed", action="store_true", help="reuse data from an earlier seed")
+    run_command.add_argument("--port", type=int, default=8011)
+    run_command.add_argument("--workers", type=int, default=1, help="uvicorn workers with --boot")
+    run_command.add_argument("--clients", type=int, default=50, help="concurrent virtual users")
+    run_command.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    run_command.add_argument("--checkout-ratio", type=float, default=0.3, help="share of sessions that check out")
+    run_command.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    run_command.add_argument("--out", help="write the JSON result here")
+
+    compare_command = commands.add_parser("compare", help="fail if a run regressed against a baseline")
+    compare_command.add_argument("baseline")
+    compare_command.add_argument("current")
+    compare_command.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown")
+
+    args = parser.parse_args(argv)
+    if args.command == "seed":
+        return asyncio.run(seed_main(args))
+    if args.command == "compare":
+        regressions = compare(json.loads(Path(args.baseline).read_text()), json.loads(Path(args.current).read_text()),
+                              args.tolerance)
+        for line in regressions:
+            print(line)
+        return 1 if regressions else 0
+
+    result = asyncio.run(run(args))
+    print_summary(result)
+    if args.out:
+        Path(args.out).write_text(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""Prometheus-style metrics without an external client library.
+
+The hot path only increments preallocated counters. A histogram child is
+created the first time a label pair is seen and reused from then on. Request
+recording does one dict lookup per label and one ``bisect`` per observation.
+Everything else is computed by collectors when ``/metrics`` is scraped:
+bcrypt queue depth, cache hit ratios and so on.
+"""
+import bisect
+import threading
+import time
+from collections import namedtuple
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# What a collector yields: samples is a list of (labels dict, value)
+MetricFamily = namedtuple("MetricFamily", "name kind help samples")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class HistogramVec:
+    """Histograms keyed by exactly two label values, stored as nested dicts (no tuple keys)."""
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, str], buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._children: Dict[str, Dict[str, Histogram]] = {}
+
+    def child(self, first: str, second: str) -> Histogram:
+        inner = self._children.get(first)
+        if inner is None:
+            inner = self._children[first] = {}
+        histogram = inner.get(second)
+        if histogram is None:
+            histogram = inner[second] = Histogram(self.buckets)
+        return histogram
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        first_name, second_name = self.label_names
+        for first, inner in sorted(self._children.items()):
+            for second, histogram in sorted(inner.items()):
+                labels = {first_name: first, second_name: second}
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {histogram.sum!r}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {histogram.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._histograms: List[HistogramVec] = []
+        self._collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+
+    def histogram(self, name: str, help: str, label_names: Tuple[str, str],
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> HistogramVec:
+        histogram = HistogramVec(name, help, label_names, buckets)
+        self._histograms.append(histogram)
+        return histogram
+
+    def collector(self, collect: Callable[[], Iterable[MetricFamily]]):
+        """Register ``collect()``, called on every scrape; usable as a decorator."""
+        self._collectors.append(collect)
+        return collect
+
+    def render(self) -> str:
+        lines = []
+        for histogram in self._histograms:
+            lines += histogram.render()
+        for collect in self._collectors:
+            for family in collect():
+                lines.append(f"# HELP {family.name} {family.help}")
+                lines.append(f"# TYPE {family.name} {family.kind}")
+                for labels, value in family.samples:
+                    lines.append(f"{family.name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class RequestMetrics:
+    """Per-route latency and in-flight requests, fed by ``MetricsMiddleware``."""
+
+    def __init__(self, registry: Registry):
+        self.latency = registry.histogram(
+            "http_request_duration_seconds", "HTTP request latency by route template", ("route", "method"),
+        )
+        self.in_flight = 0
+        registry.collector(self._collect)
+
+    def _collect(self):
+        yield MetricFamily("http_requests_in_flight", "gauge", "HTTP requests being served", [({}, self.in_flight)])
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware; records after the router has put the matched route in the scope."""
+
+    def __init__(self, app, metrics: RequestMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        metrics = self.metrics
+        metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            metrics.in_flight -= 1
+            route = scope.get("route")
+            # Unmatched paths share one label so scanners can't blow up the series count
+            path = route.path if route is not None else "unmatched"
+            metrics.latency.child(path, scope["method"]).observe(time.perf_counter() - started)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Command latency by collection and command name, via pymongo command monitoring.
+
+    Motor runs pymongo on worker threads, so updates take a lock.
+    """
+
+    def __init__(self, registry: Registry):
+        self.latency = registry.histogram(
+            "mongodb_command_duration_seconds", "MongoDB command latency", ("collection", "command"),
+        )
+        self.failures = 0
+        self._collections: Dict[Tuple[int, object], str] = {}
+        self._lock = threading.Lock()
+        registry.collector(self._collect)
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.command.get("collection", "-")
+        with self._lock:
+            self._collections[event.request_id, event.connection_id] = collection
+
+    def succeeded(self, event):
+        with self._lock:
+            collection = self._collections.pop((event.request_id, event.connection_id), "-")
+            self.latency.child(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        with self._lock:
+            collection = self._collections.pop((event.request_id, event.connection_id), "-")
+            self.latency.child(collection, event.command_name).observe(event.duration_micros / 1e6)
+            self.failures += 1
+
+    def _collect(self):
+        yield MetricFamily("mongodb_command_failures_total", "counter", "Failed MongoDB commands", [({}, self.failures)])
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection checkout wait times and pool occupancy per server, via pymongo pool monitoring."""
+
+    def __init__(self, registry: Registry):
+        self.wait = registry.histogram(
+            "mongodb_pool_wait_seconds", "Time spent waiting to check a connection out of the pool", ("address", "outcome"),
+        )
+        self._pools: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        registry.collector(self._collect)
+
+    def _pool(self, address) -> Dict[str, int]:
+        key = f"{address[0]}:{address[1]}"
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = {"open": 0, "checked_out": 0, "waiting": 0, "cleared": 0, "failed_checkouts": 0}
+        return pool
+
+    def pool_created(self, event):
+        with self._lock:
+            self._pool(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self._pool(event.address)["cleared"] += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self._pool(event.address)["open"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._pool(event.address)["open"] -= 1
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self._pool(event.address)["waiting"] += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["waiting"] -= 1
+            pool["checked_out"] += 1
+            self.wait.child(f"{event.address[0]}:{event.address[1]}", "ok").observe(event.duration or 0.0)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["waiting"] -= 1
+            pool["failed_checkouts"] += 1
+            self.wait.child(f"{event.address[0]}:{event.address[1]}", event.reason).observe(event.duration or 0.0)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._pool(event.address)["checked_out"] -= 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {address: dict(pool) for address, pool in self._pools.items()}
+
+    def _collect(self):
+        pools = self.snapshot()
+        for field, kind, help in (
+            ("open", "gauge", "Open connections in the pool"),
+            ("checked_out", "gauge", "Connections checked out of the pool"),
+            ("waiting", "gauge", "Operations waiting for a pooled connection"),
+            ("cleared", "counter", "Times the pool was cleared after an error"),
+            ("failed_checkouts", "counter", "Connection checkouts that failed or timed out"),
+        ):
+            suffix = "_total" if kind == "counter" else ""
+            yield MetricFamily(f"mongodb_pool_{field}{suffix}", kind, help,
+                               [({"address": address}, pool[field]) for address, pool in pools.items()])
+
+
+def cache_families(caches: Dict[str, dict]) -> List[MetricFamily]:
+    """Turn ``TTLCache.stats()`` results keyed by cache name into metric families."""
+    fields = [
+        ("cache_hits_total", "counter", "Cache hits", "hits"),
+        ("cache_misses_total", "counter", "Cache misses", "misses"),
+        ("cache_evictions_total", "counter", "Cache evictions", "evictions"),
+        ("cache_hit_ratio", "gauge", "Cache hit ratio since start", "hit_ratio"),
+        ("cache_entries", "gauge", "Entries currently cached", "size"),
+    ]
+    return [
+        MetricFamily(name, kind, help, [({"cache": cache}, stats[field]) for cache, stats in caches.items()])
+        for name, kind, help, field in fields
+    ]
@@ -0,0 +1,77 @@
+"""Move base64 images out of product, category and cart documents.
+
+Every ``gambar`` holding a data URI is written to the configured image store
+and replaced by its ``/api/images/<sha256>`` URL. Safe to run repeatedly.
+
+Usage: python migrate_images.py [--dry-run]
+"""
+import argparse
+import asyncio
+import logging
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from catalog_cache import bump_versions
+from image_store import create_image_store, externalize_image
+
+ROOT_DIR = Path(__file__).parent
+BATCH_SIZE = 500
+
+logger = logging.getLogger("migrate_images")
+
+
+async def _flush(collection, ops, dry_run):
+    if ops and not dry_run:
+        await collection.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+async def migrate_collection(collection, store, dry_run=False) -> int:
+    ops, migrated = [], 0
+    async for doc in collection.find({"gambar": {"$regex": "^data:"}}, {"_id": 1, "gambar": 1}):
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"gambar": await externalize_image(store, doc["gambar"])}}))
+        if len(ops) >= BATCH_SIZE:
+            migrated += await _flush(collection, ops, dry_run)
+            ops = []
+    return migrated + await _flush(collection, ops, dry_run)
+
+
+async def migrate_carts(collection, store, dry_run=False) -> int:
+    ops, migrated = [], 0
+    async for cart in collection.find({"items.gambar": {"$regex": "^data:"}}, {"_id": 1, "items": 1}):
+        items = cart["items"]
+        for item in items:
+            item["gambar"] = await externalize_image(store, item.get("gambar"))
+        ops.append(UpdateOne({"_id": cart["_id"]}, {"$set": {"items": items}}))
+        if len(ops) >= BATCH_SIZE:
+            migrated += await _flush(collection, ops, dry_run)
+            ops = []
+    return migrated + await _flush(collection, ops, dry_run)
+
+
+async def main(dry_run: bool):
+    load_dotenv(ROOT_DIR / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    store = create_image_store(db, os.environ.get('IMAGE_STORE', 'local'), os.environ.get('IMAGE_STORE_PATH'))
+    try:
+        for name in ("products", "categories"):
+            count = await migrate_collection(db[name], store, dry_run)
+            logger.info("%s: %d documents migrated", name, count)
+            if count and not dry_run:
+                await bump_versions(db, [name])
+        count = await migrate_carts(db.carts, store, dry_run)
+        logger.info("carts: %d documents migrated", count)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="store images but leave documents untouched")
+    asyncio.run(main(parser.parse_args().dry_run))
@@ -0,0 +1,322 @@
+"""Per-request timing breakdown, slow request/query logs and sampled profiles.
+
+``ProfilingMiddleware`` puts a ``RequestTimings`` in a context variable for
+the duration of each request. The request's work adds to it from several
+places:
+
+* ``phase("auth")`` / ``phase("bcrypt")`` blocks in the handlers;
+* ``TimedRoute`` (endpoint body, plus FastAPI's request/response model
+  validation around it);
+* ``TimedJSONResponse`` (JSON encoding);
+* the pymongo command listener (time spent in MongoDB). Motor copies the
+  context into its executor threads, so commands are attributed to the
+  request that issued them.
+
+Phases can overlap: ``db`` includes queries made during ``auth``, for example.
+Requests slower than the threshold are written as JSON lines to the
+``slow_requests`` logger. Mongo commands slower than theirs go to
+``slow_queries``, with literal values replaced by ``"?"``.
+
+When sampling is on, a background thread snapshots the event-loop thread's
+stack every few milliseconds. It attributes each sample to the request whose
+middleware frame is on that stack. The collapsed stacks of the slowest N
+requests in each minute are kept for the admin endpoint.
+"""
+import asyncio
+import functools
+import heapq
+import json
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from pymongo import monitoring
+
+slow_request_logger = logging.getLogger("slow_requests")
+slow_query_logger = logging.getLogger("slow_queries")
+
+PHASES = ("auth", "bcrypt", "db", "endpoint", "model", "serialize")
+# Command fields that carry payload or driver bookkeeping rather than query shape
+UNLOGGED_FIELDS = {"documents", "lsid", "$clusterTime", "$db", "txnNumber", "signature", "$readPreference"}
+MAX_STACKS_PER_PROFILE = 50
+
+
+class RequestTimings:
+    __slots__ = ("path", "phases", "db_commands", "samples")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.db_commands = 0
+        self.samples: Optional[Dict[str, int]] = None
+
+
+current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def phase(name: str):
+    """Add the wall time of the block to the current request's ``name`` phase."""
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.phases[name] += time.perf_counter() - started
+
+
+def query_shape(value):
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [query_shape(item) for item in value[:3]]
+    return "?"
+
+
+class TimedRoute(APIRoute):
+    """Splits handler time into the endpoint body and FastAPI's validation around it."""
+
+    def get_route_handler(self):
+        endpoint = self.dependant.call
+        if asyncio.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def timed_endpoint(*args, **kwargs):
+                with phase("endpoint"):
+                    return await endpoint(*args, **kwargs)
+            self.dependant.call = timed_endpoint
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            started = time.perf_counter()
+            response = await handler(request)
+            timings = current_timings.get()
+            if timings is not None:
+                phases = timings.phases
+                # Whatever isn't the endpoint, auth or encoding is parameter and response_model validation
+                phases["model"] += max(
+                    time.perf_counter() - started - phases["endpoint"] - phases["auth"] - phases["serialize"], 0.0,
+                )
+            return response
+
+        return timed_handler
+
+
+class TimedJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        with phase("serialize"):
+            return super().render(content)
+
+
+class _CommandTimer(monitoring.CommandListener):
+    def __init__(self, profiler: "RequestProfiler"):
+        self.profiler = profiler
+        self._commands: Dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self._commands[event.request_id, event.connection_id] = event.command
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        with self._lock:
+            command = self._commands.pop((event.request_id, event.connection_id), None)
+            # Runs on a Motor worker thread, inside the issuing request's context
+            timings = current_timings.get()
+            if timings is not None:
+                timings.phases["db"] += event.duration_micros / 1e6
+                timings.db_commands += 1
+        duration_ms = event.duration_micros / 1000
+        if command is not None and duration_ms >= self.profiler.slow_query_ms:
+            slow_query_logger.warning(json.dumps({
+                "time": datetime.utcnow().isoformat(),
+                "command": event.command_name,
+                "duration_ms": round(duration_ms, 2),
+                "path": timings.path if timings else None,
+                "query": {
+                    key: value if key == event.command_name else query_shape(value)
+                    for key, value in command.items() if key not in UNLOGGED_FIELDS
+                },
+            }, default=str))
+
+
+class _Sampler:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.tracked: Dict[object, RequestTimings] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._target_thread: Optional[int] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread:
+            return
+        # Sample the thread running the event loop, i.e. the caller's
+        self._target_thread = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="request-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.tracked.clear()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target_thread)
+            names = []
+            while frame is not None:
+                timings = self.tracked.get(frame)
+                if timings is not None:
+                    if timings.samples is None:
+                        timings.samples = {}
+                    stack = ";".join(reversed(names))
+                    timings.samples[stack] = timings.samples.get(stack, 0) + 1
+                    break
+                code = frame.f_code
+                names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+
+
+class RequestProfiler:
+    def __init__(self, slow_request_ms: float = 500.0, slow_query_ms: float = 100.0, top_n: int = 5,
+                 sample_interval: float = 0.005, history_minutes: int = 10, recent: int = 100):
+        self.slow_request_ms = slow_request_ms
+        self.slow_query_ms = slow_query_ms
+        self.top_n = top_n
+        self.listener = _CommandTimer(self)
+        self._sampler = _Sampler(sample_interval)
+        self._recent = deque(maxlen=recent)
+        # (minute, heap of (total_ms, sequence, profile)) for the last few minutes
+        self._profiles = deque(maxlen=history_minutes)
+        self._sequence = 0
+
+    # Sampling toggle
+
+    @property
+    def sampling(self) -> bool:
+        return self._sampler.running
+
+    def set_sampling(self, enabled: bool):
+        if enabled:
+            self._sampler.start()
+        else:
+            self._sampler.stop()
+
+    # Request lifecycle (called by the middleware)
+
+    def track(self, frame, timings: RequestTimings):
+        self._sampler.tracked[frame] = timings
+
+    def finish(self, frame, scope, status: int, total: float, timings: RequestTimings):
+        self._sampler.tracked.pop(frame, None)
+        total_ms = total * 1000
+        if total_ms < self.slow_request_ms and timings.samples is None:
+            return
+        route = scope.get("route")
+        entry = {
+            "time": datetime.utcnow().isoformat(),
+            "method": scope["method"],
+            "route": route.path if route is not None else None,
+            "path": scope["path"],
+            "status": status,
+            "total_ms": round(total_ms, 2),
+            "phases_ms": {name: round(value * 1000, 2) for name, value in timings.phases.items()},
+            "db_commands": timings.db_commands,
+        }
+        if total_ms >= self.slow_request_ms:
+            slow_request_logger.warning(json.dumps(entry))
+            self._recent.append(entry)
+        if timings.samples:
+            self._keep_profile(entry, timings.samples)
+
+    def _keep_profile(self, entry: dict, samples: Dict[str, int]):
+        minute = entry["time"][:16]
+        if not self._profiles or self._profiles[-1][0] != minute:
+            self._profiles.append((minute, []))
+        heap = self._profiles[-1][1]
+        self._sequence += 1
+        if len(heap) == self.top_n and entry["total_ms"] <= heap[0][0]:
+            return
+        stacks = sorted(samples.items(), key=lambda item: -item[1])[:MAX_STACKS_PER_PROFILE]
+        profile = {**entry, "samples": sum(samples.values()), "stacks": dict(stacks)}
+        item = (entry["total_ms"], self._sequence, profile)
+        if len(heap) < self.top_n:
+            heapq.heappush(heap, item)
+        else:
+            heapq.heapreplace(heap, item)
+
+    # Admin views
+
+    def recent_slow_requests(self) -> List[dict]:
+        return list(reversed(self._recent))
+
+    def profiles(self) -> List[dict]:
+        return [
+            {"minute": minute, "requests": [profile for _, _, profile in sorted(heap, reverse=True)]}
+            for minute, heap in reversed(self._profiles)
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "slow_request_ms": self.slow_request_ms,
+            "slow_query_ms": self.slow_query_ms,
+            "sampling": self.sampling,
+            "sample_interval_ms": self._sampler.interval * 1000,
+            "top_n": self.top_n,
+        }
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profiler = self.profiler
+        timings = RequestTimings(scope["path"])
+        token = current_timings.set(timings)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        # The sampler recognises this request by this frame being on the loop's stack
+        frame = sys._getframe()
+        if profiler.sampling:
+            profiler.track(frame, timings)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_timings.reset(token)
+            profiler.finish(frame, scope, status, time.perf_counter() - started, timings)
@@ -0,0 +1,277 @@
+"""Stock reservations.
+
+Putting a product in the cart holds its quantity against ``products.stok``.
+Held quantities are counted per product in ``reserved_stock``, not in the
+product document, so cart traffic never looks like a catalog change to the
+catalog cache, search index or ETags. A reservation increments the counter
+atomically and checks the result against ``stok``. If the counter went past
+the stock, the increment is undone and the buyer is turned away, so
+concurrent buyers can never hold more than is in stock.
+
+Each user's hold is recorded in ``stock_reservations``, one active document
+per (user, product) with an ``expires_at`` deadline. Any cart activity pushes
+that deadline back. A background sweeper claims expired reservations one at a
+time and drops their quantity from the counter. Checkout consumes the
+reservations and settles the sold quantity into ``products.stok``.
+
+The counter and the reservation are separate writes, so a request cancelled
+or failing between them leaves the counter off. The sweeper also compares
+each counter with the sum of the product's active reservations and resets
+the ones that disagree the same way on two sweeps in a row; an update in
+flight never looks like that.
+
+Finished reservations get a ``released_at`` timestamp, and a TTL index on that
+field deletes them later. The TTL index deliberately does not use
+``expires_at``: MongoDB would then delete active reservations without
+returning their stock.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = "active"
+
+
+class InsufficientStock(Exception):
+    """Raised when a product does not have enough stock left to reserve."""
+
+    def __init__(self, product_id: str, available: int):
+        super().__init__(f"Only {available} left of product {product_id}")
+        self.product_id = product_id
+        self.available = available
+
+
+class StockReservations:
+    def __init__(self, db, ttl: float = 900.0, sweep_interval: float = 30.0):
+        self.db = db
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._counts = {"reserved": 0, "rejected": 0, "released": 0, "expired": 0, "consumed": 0, "reconciled": 0}
+        # product_id -> (counter, active sum) as last seen disagreeing
+        self._drift: Dict[str, Tuple[int, int]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _deadline(self, now: datetime) -> datetime:
+        return now + timedelta(seconds=self.ttl)
+
+    async def reserve(self, user_id: str, product_id: str, quantity: int, session=None):
+        """Take ``quantity`` more of ``product_id`` out of stock for ``user_id``."""
+        if quantity <= 0:
+            return
+        held = await self.db.reserved_stock.find_one_and_update(
+            {"_id": product_id},
+            {"$inc": {"quantity": quantity}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+            session=session,
+        )
+        product = await self.db.products.find_one({"id": product_id}, {"_id": 0, "stok": 1}, session=session)
+        stock = (product or {}).get("stok", 0)
+        # Every buyer sees a different counter value, so at most the stock's worth of them pass
+        if held["quantity"] > stock:
+            await self._unhold(product_id, quantity, session)
+            self._counts["rejected"] += 1
+            raise InsufficientStock(product_id, max(stock - (held["quantity"] - quantity), 0))
+
+        now = datetime.utcnow()
+        update = {
+            "$inc": {"quantity": quantity},
+            "$set": {"expires_at": self._deadline(now)},
+            "$setOnInsert": {"id": str(uuid.uuid4()), "created_at": now},
+        }
+        key = {"user_id": user_id, "product_id": product_id, "status": ACTIVE}
+        try:
+            try:
+                await self.db.stock_reservations.update_one(key, update, upsert=True, session=session)
+            except DuplicateKeyError:
+                # A concurrent request by the same user created the reservation first
+                await self.db.stock_reservations.update_one(key, update, upsert=True, session=session)
+        except PyMongoError:
+            await self._unhold(product_id, quantity, session)
+            raise
+        self._counts["reserved"] += quantity
+
+    async def _take(self, user_id: str, product_id: str, quantity: Optional[int], status: str, session=None) -> int:
+        """Take up to ``quantity`` (default: all) off a reservation, closing it with ``status`` once empty."""
+        now = datetime.utcnow()
+        remaining = {"$max": [0, {"$subtract": ["$quantity", quantity]}]} if quantity else 0
+        before = await self.db.stock_reservations.find_one_and_update(
+            {"user_id": user_id, "product_id": product_id, "status": ACTIVE},
+            [
+                {"$set": {"quantity": remaining}},
+                {"$set": {
+                    "status": {"$cond": [{"$gt": ["$quantity", 0]}, ACTIVE, status]},
+                    "released_at": {"$cond": [{"$gt": ["$quantity", 0]}, "$$REMOVE", now]},
+                }},
+            ],
+            session=session,
+        )
+        if before is None:
+            return 0
+        taken = before["quantity"] if not quantity else min(quantity, before["quantity"])
+        await self._unhold(product_id, taken, session)
+        return taken
+
+    async def release(self, user_id: str, product_id: str, quantity: Optional[int] = None, session=None) -> int:
+        """Give back up to ``quantity`` (default: all) of a reservation; returns the amount released."""
+        released = await self._take(user_id, product_id, quantity, "released", session)
+        self._counts["released"] += released
+        return released
+
+    async def adjust(self, user_id: str, changes: Dict[str, int], session=None):
+        """Grow or shrink the user's reservations by ``changes``, a quantity delta per product.
+
+        Deltas are applied as increments, so concurrent adjustments add up
+        instead of overwriting each other. All-or-nothing: if any product is
+        short, the increases already made are undone and ``InsufficientStock``
+        is raised before anything is released. The user's remaining
+        reservations get a fresh deadline.
+        """
+        reserved = []
+        try:
+            for product_id, change in changes.items():
+                if change > 0:
+                    await self.reserve(user_id, product_id, change, session)
+                    reserved.append((product_id, change))
+        except InsufficientStock:
+            for product_id, change in reserved:
+                await self.release(user_id, product_id, change, session)
+            raise
+        for product_id, change in changes.items():
+            if change < 0:
+                await self.release(user_id, product_id, -change, session)
+
+        await self.db.stock_reservations.update_many(
+            {"user_id": user_id, "status": ACTIVE},
+            {"$set": {"expires_at": self._deadline(datetime.utcnow())}},
+            session=session,
+        )
+
+    async def hold(self, user_id: str, quantities: Dict[str, int], session=None):
+        """Top the user's reservations up to at least ``quantities``, re-taking any that lapsed.
+
+        Never releases: a surplus from a racing cart update is left to expire,
+        and checkout consumes only the quantities it sells.
+        """
+        held = {
+            reservation["product_id"]: reservation["quantity"]
+            async for reservation in self.db.stock_reservations.find(
+                {"user_id": user_id, "product_id": {"$in": list(quantities)}, "status": ACTIVE},
+                {"_id": 0, "product_id": 1, "quantity": 1},
+                session=session,
+            )
+        }
+        await self.adjust(user_id, {
+            product_id: quantity - held.get(product_id, 0)
+            for product_id, quantity in quantities.items()
+            if quantity > held.get(product_id, 0)
+        }, session)
+
+    async def consume(self, user_id: str, quantities: Dict[str, int], session=None):
+        """Turn reserved quantities into sales: they leave the reservation and ``products.stok``."""
+        ops = []
+        for product_id, quantity in quantities.items():
+            if quantity <= 0:
+                continue
+            # Stock goes down before the hold does, so the available quantity never rises in between
+            ops.append(UpdateOne({"id": product_id}, {"$inc": {"stok": -quantity}}))
+        if ops:
+            await self.db.products.bulk_write(ops, ordered=False, session=session)
+        for product_id, quantity in quantities.items():
+            if quantity > 0 and await self._take(user_id, product_id, quantity, "consumed", session):
+                self._counts["consumed"] += 1
+
+    async def restock(self, items: List[dict], session=None):
+        """Return sold quantities to stock, e.g. for a cancelled order."""
+        ops = [UpdateOne({"id": item["product_id"]}, {"$inc": {"stok": item["quantity"]}}) for item in items]
+        if ops:
+            await self.db.products.bulk_write(ops, ordered=False, session=session)
+
+    async def _unhold(self, product_id: str, quantity: int, session=None):
+        if quantity > 0:
+            await self.db.reserved_stock.update_one({"_id": product_id}, {"$inc": {"quantity": -quantity}}, session=session)
+
+    async def expire_due(self) -> int:
+        """Return the stock of every reservation past its deadline."""
+        expired = 0
+        while True:
+            now = datetime.utcnow()
+            # Claiming a reservation is atomic, so each one is returned exactly once across workers
+            reservation = await self.db.stock_reservations.find_one_and_update(
+                {"status": ACTIVE, "expires_at": {"$lte": now}},
+                {"$set": {"status": "expired", "released_at": now}},
+                projection={"_id": 0, "product_id": 1, "quantity": 1},
+                return_document=ReturnDocument.BEFORE,
+            )
+            if reservation is None:
+                break
+            await self._unhold(reservation["product_id"], reservation["quantity"])
+            expired += 1
+        self._counts["expired"] += expired
+        return expired
+
+    async def reconcile(self) -> int:
+        """Reset ``reserved_stock`` counters that have drifted from the active reservations."""
+        counters = {
+            counter["_id"]: counter["quantity"]
+            async for counter in self.db.reserved_stock.find({"quantity": {"$ne": 0}})
+        }
+        held = {
+            group["_id"]: group["quantity"]
+            async for group in self.db.stock_reservations.aggregate([
+                {"$match": {"status": ACTIVE}},
+                {"$group": {"_id": "$product_id", "quantity": {"$sum": "$quantity"}}},
+            ])
+        }
+        drift, fixed = {}, 0
+        for product_id in counters.keys() | held.keys():
+            seen = (counters.get(product_id, 0), held.get(product_id, 0))
+            if seen[0] == seen[1]:
+                continue
+            if self._drift.get(product_id) != seen:
+                drift[product_id] = seen
+                continue
+            # Only if the counter hasn't moved since it was read
+            result = await self.db.reserved_stock.update_one(
+                {"_id": product_id, "quantity": seen[0]}, {"$set": {"quantity": seen[1]}}
+            )
+            if result.modified_count:
+                logger.warning("Reserved stock of %s was %d, active reservations hold %d; reset", product_id, *seen)
+                fixed += 1
+        self._drift = drift
+        self._counts["reconciled"] += fixed
+        return fixed
+
+    def stats(self) -> dict:
+        return {"ttl": self.ttl, **self._counts}
+
+    # Background sweeper
+
+    async def start(self):
+        self._task = asyncio.create_task(self._sweep())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _sweep(self):
+        while True:
+            try:
+                expired = await self.expire_due()
+                if expired:
+                    logger.info("Returned stock for %d expired reservations", expired)
+                await self.reconcile()
+            except PyMongoError as e:
+                logger.warning("Reservation sweep failed: %s", e)
+            await asyncio.sleep(self.sweep_interval)
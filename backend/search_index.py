@@ -0,0 +1,148 @@
+"""In-memory inverted index for product search.
+
+Product ``nama``, ``kategori`` and ``deskripsi`` are tokenized with light
+Indonesian normalization: accents are folded, common function words are
+dropped and particle/possessive suffixes (-nya, -lah, -ku, ...) are stripped.
+Every query token must match. The last token also matches as a prefix, so
+the index can serve type-ahead.
+"""
+import bisect
+import heapq
+import logging
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Hashable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = {
+    "dan", "atau", "yang", "di", "ke", "dari", "untuk", "dengan", "pada", "dalam",
+    "ini", "itu", "adalah", "juga", "akan", "sebagai", "oleh", "para", "se", "the", "and", "for",
+}
+SUFFIXES = ("nya", "lah", "kah", "tah", "pun", "ku", "mu")
+FIELD_WEIGHTS = {"nama": 3.0, "kategori": 2.0, "deskripsi": 1.0}
+PREFIX_WEIGHT = 0.5
+MAX_PREFIX_EXPANSIONS = 50
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _stem(token: str) -> str:
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    return token
+
+
+def normalize(text: str) -> List[str]:
+    folded = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode().lower()
+    return [_stem(token) for token in _TOKEN_RE.findall(folded) if token not in STOPWORDS]
+
+
+class SearchIndex:
+    def __init__(self):
+        self._docs: Dict[Hashable, dict] = {}
+        self._doc_terms: Dict[Hashable, set] = {}
+        self._postings: Dict[str, Dict[Hashable, float]] = defaultdict(dict)
+        self._terms: List[str] = []
+        self._bulk = False
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, key: Hashable, doc: dict):
+        self.remove(key)
+        weights: Dict[str, float] = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in normalize(doc.get(field, "")):
+                weights[term] += weight
+        for term, weight in weights.items():
+            postings = self._postings[term]
+            if not postings and not self._bulk:
+                bisect.insort(self._terms, term)
+            postings[key] = weight
+        self._docs[key] = {k: v for k, v in doc.items() if k != "_id"}
+        self._doc_terms[key] = set(weights)
+
+    def remove(self, key: Hashable):
+        for term in self._doc_terms.pop(key, ()):
+            postings = self._postings[term]
+            postings.pop(key, None)
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+        self._docs.pop(key, None)
+
+    def clear(self):
+        self._docs.clear()
+        self._doc_terms.clear()
+        self._postings.clear()
+        self._terms.clear()
+
+    def _prefix_terms(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self._terms, prefix)
+        terms = []
+        for term in self._terms[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[int, List[dict]]:
+        tokens = normalize(query)
+        if not tokens:
+            return 0, []
+        # The last token is still being typed unless the query ends with whitespace
+        prefix_last = not query[-1:].isspace()
+
+        token_matches = []
+        for i, token in enumerate(tokens):
+            matches = self._postings.get(token, {})
+            if prefix_last and i == len(tokens) - 1:
+                matches = dict(matches)
+                for term in self._prefix_terms(token):
+                    if term == token:
+                        continue
+                    for key, weight in self._postings[term].items():
+                        matches[key] = max(matches.get(key, 0.0), weight * PREFIX_WEIGHT)
+            if not matches:
+                return 0, []
+            token_matches.append(matches)
+
+        # Intersect starting from the rarest token so the candidate set stays small
+        token_matches.sort(key=len)
+        scores = dict(token_matches[0])
+        for matches in token_matches[1:]:
+            scores = {key: score + matches[key] for key, score in scores.items() if key in matches}
+            if not scores:
+                return 0, []
+
+        top = heapq.nsmallest(
+            offset + limit, scores.items(),
+            key=lambda item: (-item[1], self._docs[item[0]].get("nama", "")),
+        )
+        return len(scores), [self._docs[key] for key, _ in top[offset:]]
+
+    async def load(self, db):
+        """(Re)build the index from every product in ``db``."""
+        fresh = SearchIndex()
+        # Sort the term list once at the end instead of inserting term by term
+        fresh._bulk = True
+        async for product in db.products.find():
+            fresh.add(product["_id"], product)
+        fresh._terms = sorted(fresh._postings)
+        self._docs, self._doc_terms = fresh._docs, fresh._doc_terms
+        self._postings, self._terms = fresh._postings, fresh._terms
+        logger.info("Search index built with %d products", len(self))
+
+    def apply_change(self, change: dict) -> bool:
+        """Apply a products change-stream event; returns False if a full rebuild is needed."""
+        operation = change.get("operationType")
+        if operation == "delete":
+            self.remove(change["documentKey"]["_id"])
+            return True
+        if operation in ("insert", "update", "replace") and change.get("fullDocument"):
+            self.add(change["documentKey"]["_id"], change["fullDocument"])
+            return True
+        return False
@@ -0,0 +1,113 @@
+"""Idempotent sample-data seeding.
+
+All categories and products go out in one unordered ``bulk_write`` of
+upserts. Seeded documents get deterministic ids, so two workers seeding at
+once collide on the unique ``id``/``nama`` indexes instead of inserting
+duplicates.
+
+Usage: python seed.py
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from catalog_cache import bump_versions
+from image_store import ImageStore, create_image_store, externalize_image
+from indexes import create_indexes
+
+logger = logging.getLogger(__name__)
+
+SEED_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "gogama-store/seed")
+DUPLICATE_KEY = 11000
+
+PLACEHOLDER_IMAGE = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+
+SAMPLE_CATEGORIES = ["Elektronik", "Fashion", "Makanan", "Kesehatan"]
+
+SAMPLE_PRODUCTS = [
+    {
+        "nama": "Smartphone Android",
+        "deskripsi": "Smartphone terbaru dengan kamera canggih",
+        "harga": 2500000.0,
+        "gambar": PLACEHOLDER_IMAGE,
+        "kategori": "Elektronik",
+        "stok": 50,
+    },
+    {
+        "nama": "T-Shirt Cotton",
+        "deskripsi": "T-Shirt berbahan cotton premium",
+        "harga": 150000.0,
+        "gambar": PLACEHOLDER_IMAGE,
+        "kategori": "Fashion",
+        "stok": 100,
+    },
+]
+
+
+def seed_id(kind: str, nama: str) -> str:
+    return str(uuid.uuid5(SEED_NAMESPACE, f"{kind}:{nama}"))
+
+
+async def _bulk_upsert(collection, ops) -> int:
+    try:
+        result = await collection.bulk_write(ops, ordered=False)
+        return result.upserted_count
+    except BulkWriteError as e:
+        # Another worker won the race for the same seed document
+        if any(err["code"] != DUPLICATE_KEY for err in e.details["writeErrors"]):
+            raise
+        return e.details["nUpserted"]
+
+
+async def seed_sample_data(db, image_store: ImageStore) -> dict:
+    now = datetime.utcnow()
+    category_ops = [
+        UpdateOne(
+            {"nama": nama},
+            {"$setOnInsert": {"id": seed_id("category", nama), "nama": nama, "created_at": now}},
+            upsert=True,
+        )
+        for nama in SAMPLE_CATEGORIES
+    ]
+    product_ops = []
+    for product in SAMPLE_PRODUCTS:
+        document = {
+            **product,
+            "id": seed_id("product", product["nama"]),
+            "gambar": await externalize_image(image_store, product["gambar"]),
+            "created_at": now,
+        }
+        product_ops.append(UpdateOne({"nama": product["nama"]}, {"$setOnInsert": document}, upsert=True))
+
+    inserted = {
+        "categories": await _bulk_upsert(db.categories, category_ops),
+        "products": await _bulk_upsert(db.products, product_ops),
+    }
+    await bump_versions(db, [name for name, count in inserted.items() if count])
+    return inserted
+
+
+async def main():
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    image_store = create_image_store(db, os.environ.get('IMAGE_STORE', 'local'), os.environ.get('IMAGE_STORE_PATH'))
+    try:
+        await create_indexes(db)
+        inserted = await seed_sample_data(db, image_store)
+        logger.info("Seeded %(categories)d categories and %(products)d products", inserted)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(main())
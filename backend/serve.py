@@ -0,0 +1,62 @@
+"""Run the API in several worker processes.
+
+    python serve.py                          # one worker per CPU on port 8001
+    python serve.py --workers 4 --port 8080
+
+Indexes and sample data are set up once here, before any worker starts.
+Workers never create indexes or seed themselves, so they come up quickly.
+SEED_ON_STARTUP=false creates the indexes without seeding. Starting workers
+any other way (``uvicorn server:app`` under supervisor, say) needs
+``python indexes.py`` or ``python seed.py`` first; until then the workers log
+the missing indexes and /api/status/ready answers 503.
+
+With more than one worker, INVALIDATION_BUS is switched on: a change one
+worker makes to a user or cart drops the stale cache entries in every other
+worker. Categories and products already stay coherent through the catalog
+cache's change detection.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from pathlib import Path
+
+import uvicorn
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import seed
+from indexes import create_indexes
+
+logger = logging.getLogger(__name__)
+
+
+async def prepare_database():
+    if os.environ.get('SEED_ON_STARTUP', 'true').lower() == 'true':
+        await seed.main()
+        return
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        await create_indexes(client[os.environ['DB_NAME']])
+    finally:
+        client.close()
+
+
+def main(args):
+    load_dotenv(Path(__file__).parent / '.env')
+    asyncio.run(prepare_database())
+    # Workers inherit the environment; server.py's load_dotenv doesn't override it
+    if args.workers > 1:
+        os.environ['INVALIDATION_BUS'] = 'true'
+    logger.info("Starting %d workers on %s:%d", args.workers, args.host, args.port)
+    uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers,
+                app_dir=str(Path(__file__).parent))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Serve the API with multiple worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: CPU count)")
+    main(parser.parse_args())
@@ -1,66 +1,335 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, Response, status
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-from passlib.context import CryptContext
-import jwt
+from contextlib import asynccontextmanager
 import os
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+from typing import List, Literal, Optional, Tuple
 import uuid
 from datetime import datetime, timedelta
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+import cart_updates
+from cache import TTLCache
+from catalog_cache import CatalogCache
+from database import DatabaseProxy, MongoConnection
+import fast_json
+from fast_json import FastJSONResponse, FastSerializer
+from hashing import HasherSaturated, PasswordHasher
+from image_store import DIGEST_RE, ImageStore, create_image_store, parse_range, thumbnail_url
+from indexes import missing_indexes
+from invalidation import InvalidationBus
+from metrics import (
+    MetricFamily, MetricsMiddleware, MongoCommandMetrics, MongoPoolMetrics, Registry, RequestMetrics, cache_families,
+)
+from profiling import ProfilingMiddleware, RequestProfiler, TimedJSONResponse, TimedRoute, phase
+from reservations import InsufficientStock, StockReservations
+from search_index import SearchIndex
+from tokens import InvalidToken, RefreshTokens, TokenVerifier
+from trending import TrendingService
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Prometheus-style metrics, served on /metrics
+metrics = Registry()
+request_metrics = RequestMetrics(metrics)
+mongo_metrics = MongoCommandMetrics(metrics)
+mongo_pool_metrics = MongoPoolMetrics(metrics)
+
+# Slow request/query logs and sampled profiles of the slowest requests
+profiler = RequestProfiler(
+    slow_request_ms=float(os.environ.get('SLOW_REQUEST_MS', 500)),
+    slow_query_ms=float(os.environ.get('SLOW_QUERY_MS', 100)),
+    top_n=int(os.environ.get('PROFILE_TOP_N', 5)),
+    sample_interval=float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000,
+)
+# Admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# MongoDB connection; the client is created by the lifespan, not at import
+mongo = MongoConnection(
+    os.environ['MONGO_URL'],
+    os.environ['DB_NAME'],
+    event_listeners=[mongo_metrics, mongo_pool_metrics, profiler.listener],
+    maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+    minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', 10)),
+    maxIdleTimeMS=int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 300000)),
+    waitQueueTimeoutMS=int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+    serverSelectionTimeoutMS=int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    connectTimeoutMS=int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+    socketTimeoutMS=int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 60000)),
+)
+db = DatabaseProxy(mongo)
+MONGO_WARMUP_CONNECTIONS = int(os.environ.get('MONGO_WARMUP_CONNECTIONS', os.environ.get('MONGO_MIN_POOL_SIZE', 10)))
+
+# Content-addressed image store (IMAGE_STORE=local|gridfs); created with the client, as GridFS needs it
+image_store: Optional[ImageStore] = None
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
 # Security setup
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt runs on a bounded pool so hashing never blocks the event loop
+password_hasher = PasswordHasher(
+    rounds=int(os.environ.get('BCRYPT_ROUNDS', 12)),
+    workers=int(os.environ.get('HASHING_WORKERS', 2)),
+    max_pending=int(os.environ.get('HASHING_MAX_PENDING', 64)),
+    mode=os.environ.get('HASHING_EXECUTOR', 'thread'),
+)
 security = HTTPBearer()
 SECRET_KEY = "gogama_store_secret_key_2025"  # In production, use a secure secret
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60  # 30 days
+# Access tokens are short-lived and carry the user's claims; refresh tokens are rotated on every use
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', 15))
+refresh_tokens = RefreshTokens(
+    db, SECRET_KEY,
+    ttl=timedelta(days=float(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', 30))),
+    reuse_grace=timedelta(seconds=float(os.environ.get('REFRESH_REUSE_GRACE_SECONDS', 10))),
+)
+
+# Verified token claims plus a Bloom-filter mirror of revoked_tokens, so auth needs no DB round-trip
+token_verifier = TokenVerifier(
+    db, SECRET_KEY, ALGORITHM,
+    cache_size=int(os.environ.get('TOKEN_CACHE_SIZE', 10000)),
+    capacity=int(os.environ.get('REVOCATION_CAPACITY', 100000)),
+    sync_interval=float(os.environ.get('REVOCATION_SYNC_INTERVAL', 5)),
+)
+
+# Resolved users keyed by token subject, so authentication skips the users lookup
+user_cache = TTLCache(
+    maxsize=int(os.environ.get('USER_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('USER_CACHE_TTL', 60)),
+)
+
+# Product summaries used to hydrate carts, keyed by product id
+product_cache = TTLCache(
+    maxsize=int(os.environ.get('PRODUCT_CACHE_SIZE', 5000)),
+    ttl=float(os.environ.get('PRODUCT_CACHE_TTL', 300)),
+)
+PRODUCT_SUMMARY_PROJECTION = {"_id": 0, "id": 1, "nama": 1, "harga": 1, "gambar": 1}
+CART_THUMBNAIL_SIZE = 256
+
+# In-process cart versions so GET /api/cart can answer If-None-Match without a DB read.
+# Kept short-lived in case an invalidation from another worker is lost.
+cart_versions = TTLCache(
+    maxsize=int(os.environ.get('USER_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('CART_VERSION_TTL', 30)),
+)
+
+# With several workers (serve.py), changes made in one drop the matching entries in all the others
+invalidation_bus = InvalidationBus(db, enabled=os.environ.get('INVALIDATION_BUS', 'false').lower() == 'true')
+invalidation_bus.register("users", user_cache)
+invalidation_bus.register("carts", cart_versions)
+
+# Opt-in: serialize raw Mongo documents with orjson instead of building Pydantic models
+FAST_JSON = os.environ.get('FAST_JSON', 'false').lower() == 'true'
+
+# Cache-Control policy per route; everything is per-user, so nothing is shared-cacheable
+CACHE_POLICIES = {
+    "products": "private, max-age=60",
+    "product": "private, max-age=300",
+    "categories": "private, max-age=300",
+    "cart": "private, no-cache",
+    "trending": "private, max-age=60",
+    "home": "private, max-age=30",
+}
+
+# Combined home payload: (etag, encoded body), rebuilt at most once per TTL
+HOME_LIMITS = {"banners": 10, "brands": 20, "categories": 50, "trending": 20, "promotions": 20, "products": 20}
+home_cache = TTLCache(maxsize=1, ttl=float(os.environ.get('HOME_CACHE_TTL', 15)))
+home_lock = asyncio.Lock()
+
+# Categories and per-category product lists, versioned by the catalog_versions counters
+catalog_cache = CatalogCache(db, poll_interval=float(os.environ.get('CATALOG_POLL_INTERVAL', 30)))
+
+# Cart quantities are held out of stock until checkout or until the reservation lapses
+stock_reservations = StockReservations(
+    db,
+    ttl=float(os.environ.get('RESERVATION_TTL', 900)),
+    sweep_interval=float(os.environ.get('RESERVATION_SWEEP_INTERVAL', 30)),
+)
+
+# Trending ranking, materialized in the background and served from memory
+trending = TrendingService(
+    db,
+    refresh_interval=float(os.environ.get('TRENDING_REFRESH_INTERVAL', 300)),
+    half_life=timedelta(hours=float(os.environ.get('TRENDING_HALF_LIFE_HOURS', 72))),
+    window=timedelta(days=float(os.environ.get('TRENDING_WINDOW_DAYS', 14))),
+    size=int(os.environ.get('TRENDING_SIZE', 200)),
+    flush_interval=float(os.environ.get('TRENDING_FLUSH_INTERVAL', 5)),
+    max_buffered=int(os.environ.get('TRENDING_MAX_BUFFERED', 10000)),
+)
+
+# Product search, built at startup and kept current from catalog change events
+search_index = SearchIndex()
+search_rebuild: Optional[asyncio.Task] = None
+
+def on_catalog_change(collection: str, change: Optional[dict]):
+    global search_rebuild
+    if collection == "products":
+        product_cache.clear()
+        trending.products_changed()
+        if change is None or not search_index.apply_change(change):
+            if search_rebuild is None or search_rebuild.done():
+                search_rebuild = asyncio.create_task(search_index.load(db))
+
+catalog_cache.on_invalidate(on_catalog_change)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup_event()
+    try:
+        yield
+    finally:
+        await shutdown_db_client()
 
 # Create the main app without a prefix
-app = FastAPI(title="Gogama Store API", version="1.0.0")
+app = FastAPI(title="Gogama Store API", version="1.0.0", default_response_class=TimedJSONResponse, lifespan=lifespan)
 
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=TimedRoute)
+
+@app.exception_handler(HasherSaturated)
+async def hasher_saturated_handler(request, exc: HasherSaturated):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server sedang sibuk, silakan coba lagi"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(InsufficientStock)
+async def insufficient_stock_handler(request, exc: InsufficientStock):
+    return JSONResponse(
+        status_code=409,
+        content={"detail": "Stok tidak mencukupi", "product_id": exc.product_id, "available": exc.available},
+    )
 
 # Utility functions
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    with phase("bcrypt"):
+        return await password_hasher.hash(password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    # Returns (valid, new_hash); new_hash is set when the stored bcrypt cost is outdated
+    with phase("bcrypt"):
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
+    return token_verifier.encode(to_encode)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def access_token_claims(user: dict) -> dict:
+    # Everything handlers read from current_user, so authorizing a request needs no users lookup
+    return {
+        "sub": user["email"],
+        "id": user["id"],
+        "nama_lengkap": user["nama_lengkap"],
+        "nomor_whatsapp": user["nomor_whatsapp"],
+    }
+
+def encode_cursor(created_at: datetime, doc_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), doc_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=401, detail="Could not validate credentials")
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), str(doc_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_fields(fields: Optional[str], allowed: set, required: set) -> Optional[dict]:
+    """Turn a comma separated ``fields=`` value into a Mongo projection."""
+    if not fields:
+        return None
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - allowed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    projection = {f: 1 for f in requested | required}
+    projection["_id"] = 0
+    return projection
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+async def get_product_summaries(product_ids: List[str]) -> dict:
+    """Resolve product summaries by id from the cache, loading misses with one $in query."""
+    found, missing = {}, []
+    for product_id in dict.fromkeys(product_ids):
+        product = product_cache.get(product_id)
+        if product is None:
+            missing.append(product_id)
+        else:
+            found[product_id] = product
+    if missing:
+        async for product in db.products.find({"id": {"$in": missing}}, PRODUCT_SUMMARY_PROJECTION):
+            product_cache.set(product["id"], product)
+            found[product["id"]] = product
+    return found
+
+def check_not_modified(request: Request, response: Response, etag: str, cache_control: str) -> Optional[Response]:
+    """Attach validators to ``response`` and return a 304 if the client already has ``etag``."""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
+
+async def load_user(email: str) -> dict:
+    user = user_cache.get(email)
+    if user is None:
         user = await db.users.find_one({"email": email})
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
-        return user
-    except jwt.PyJWTError:
-        raise HTTPException(status_code=401, detail="Could not validate credentials")
+        user_cache.set(email, user)
+    return user
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    with phase("auth"):
+        try:
+            payload = await token_verifier.verify(credentials.credentials)
+            email: str = payload.get("sub")
+            if email is None:
+                raise HTTPException(status_code=401, detail="Could not validate credentials")
+            if "id" in payload:
+                return {
+                    "id": payload["id"],
+                    "email": email,
+                    "nama_lengkap": payload["nama_lengkap"],
+                    "nomor_whatsapp": payload["nomor_whatsapp"],
+                }
+            # Tokens issued before claims were embedded
+            return await load_user(email)
+        except InvalidToken:
+            raise HTTPException(status_code=401, detail="Could not validate credentials")
+
+async def get_current_user_record(current_user: dict = Depends(get_current_user)):
+    """The full users document, for the few handlers that need more than the token claims."""
+    return await load_user(current_user["email"])
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    # compare_digest only accepts ASCII str, so compare bytes; a non-ASCII header is then just wrong
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
 
 # Models
 class UserRegister(BaseModel):
@@ -82,25 +351,96 @@ class UserResponse(BaseModel):
 
 class Token(BaseModel):
     access_token: str
+    refresh_token: str
     token_type: str
+    expires_in: int
     user: UserResponse
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
 class Product(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     nama: str
     deskripsi: str
     harga: float
-    gambar: str  # base64 image
+    gambar: str  # image URL (/api/images/<sha256>)
     kategori: str
     stok: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class ProductFields(BaseModel):
+    # Partial product returned when the client asks for a field projection
+    id: str
+    nama: Optional[str] = None
+    deskripsi: Optional[str] = None
+    harga: Optional[float] = None
+    gambar: Optional[str] = None
+    kategori: Optional[str] = None
+    stok: Optional[int] = None
+    created_at: Optional[datetime] = None
+
+PRODUCT_FIELDS = set(Product.model_fields)
+PRODUCT_JSON = FastSerializer(Product)
+PRODUCT_FIELDS_JSON = FastSerializer(ProductFields, exclude_unset=True)
+
 class Category(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     nama: str
     gambar: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+CATEGORY_JSON = FastSerializer(Category)
+
+# Home screen sections; field names follow what the app already reads
+class Banner(BaseModel):
+    id: str
+    title: str
+    subtitle: Optional[str] = None
+    image: str
+    link: Optional[str] = None
+
+class Brand(BaseModel):
+    id: str
+    nama: str
+    logo: Optional[str] = None
+
+class Promotion(BaseModel):
+    id: str
+    productIds: List[str] = []
+    discountPrice: float = 0.0
+    discountPercentage: float = 0.0
+    promoText: str = "Promo"
+    startDate: datetime
+    endDate: datetime
+
+class ProductCard(BaseModel):
+    # Product tile on the home screen: no description, thumbnail image
+    id: str
+    nama: str
+    harga: float
+    gambar: str
+    kategori: str
+    stok: int = 0
+
+class Home(BaseModel):
+    banners: List[Banner]
+    brands: List[Brand]
+    categories: List[Category]
+    trending: List[ProductCard]
+    promotions: List[Promotion]
+    products: List[ProductCard]
+
+PRODUCT_CARD_JSON = FastSerializer(ProductCard)
+HOME_SERIALIZERS = {
+    "banners": FastSerializer(Banner),
+    "brands": FastSerializer(Brand),
+    "categories": CATEGORY_JSON,
+    "trending": PRODUCT_CARD_JSON,
+    "promotions": FastSerializer(Promotion),
+    "products": PRODUCT_CARD_JSON,
+}
+
 class CartItem(BaseModel):
     product_id: str
     nama: str
@@ -108,11 +448,56 @@ class CartItem(BaseModel):
     gambar: str
     quantity: int = 1
 
+class CartOperation(BaseModel):
+    op: Literal["set", "increment", "remove"]
+    product_id: str
+    quantity: int = 1  # ignored for "remove"; "set" to 0 removes the line
+
+class CartPatch(BaseModel):
+    operations: List[CartOperation] = Field(..., min_length=1, max_length=100)
+
+ORDER_STATUSES = ("pending", "confirmed", "processing", "shipped", "delivered", "completed", "cancelled")
+
+class OrderItem(BaseModel):
+    product_id: str
+    nama: str
+    harga: float
+    gambar: str
+    quantity: int
+
+class CheckoutRequest(BaseModel):
+    nama_penerima: str
+    alamat: str
+    nomor_whatsapp: str
+    metode_pembayaran: str
+    metode_pengiriman: Optional[str] = None
+    ongkos_kirim: float = Field(0.0, ge=0)
+    catatan: Optional[str] = None
+
+class Order(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    items: List[OrderItem]
+    subtotal: float
+    ongkos_kirim: float = 0.0
+    total: float
+    status: str = "pending"
+    status_pembayaran: str = "unpaid"
+    nama_penerima: str
+    alamat: str
+    nomor_whatsapp: str
+    metode_pembayaran: str
+    metode_pengiriman: Optional[str] = None
+    catatan: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
 class Cart(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
     items: List[CartItem] = []
     total: float = 0.0
+    item_count: int = 0
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 # Auth endpoints
@@ -124,7 +509,7 @@ async def register(user_data: UserRegister):
         raise HTTPException(status_code=400, detail="Email sudah terdaftar")
     
     # Hash password
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await hash_password(user_data.password)
     
     # Create user document
     user_doc = {
@@ -139,8 +524,9 @@ async def register(user_data: UserRegister):
     # Insert user into database
     await db.users.insert_one(user_doc)
     
-    # Create access token
-    access_token = create_access_token(data={"sub": user_data.email})
+    # Create access and refresh tokens
+    access_token = create_access_token(access_token_claims(user_doc))
+    refresh_token = await refresh_tokens.issue(user_doc["id"])
     
     # Prepare user response
     user_response = UserResponse(
@@ -151,7 +537,13 @@ async def register(user_data: UserRegister):
         created_at=user_doc["created_at"]
     )
     
-    return Token(access_token=access_token, token_type="bearer", user=user_response)
+    return Token(
+        access_token=access_token,
+        refresh_token=refresh_token,
+        token_type="bearer",
+        expires_in=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        user=user_response,
+    )
 
 @api_router.post("/auth/login", response_model=Token)
 async def login(user_credentials: UserLogin):
@@ -161,11 +553,18 @@ async def login(user_credentials: UserLogin):
         raise HTTPException(status_code=401, detail="Email atau password salah")
     
     # Verify password
-    if not verify_password(user_credentials.password, user["password"]):
+    valid, new_hash = await verify_password(user_credentials.password, user["password"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Email atau password salah")
     
-    # Create access token
-    access_token = create_access_token(data={"sub": user["email"]})
+    # Transparently upgrade hashes created with a different bcrypt cost
+    if new_hash:
+        await db.users.update_one({"id": user["id"]}, {"$set": {"password": new_hash}})
+        invalidation_bus.invalidate("users", user["email"])
+    
+    # Create access and refresh tokens
+    access_token = create_access_token(access_token_claims(user))
+    refresh_token = await refresh_tokens.issue(user["id"])
     
     # Prepare user response
     user_response = UserResponse(
@@ -176,110 +575,548 @@ async def login(user_credentials: UserLogin):
         created_at=user["created_at"]
     )
     
-    return Token(access_token=access_token, token_type="bearer", user=user_response)
+    return Token(
+        access_token=access_token,
+        refresh_token=refresh_token,
+        token_type="bearer",
+        expires_in=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        user=user_response,
+    )
+
+@api_router.post("/auth/refresh", response_model=Token)
+async def refresh(request: RefreshRequest):
+    # The only auth endpoint besides login that reads the users collection
+    rotated = await refresh_tokens.rotate(request.refresh_token)
+    if rotated is None:
+        raise HTTPException(status_code=401, detail="Sesi telah berakhir, silakan login kembali")
+    record, refresh_token = rotated
+    user = await db.users.find_one({"id": record["user_id"]})
+    if user is None:
+        await refresh_tokens.revoke_family(record["family"])
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    access_token = create_access_token(access_token_claims(user))
+    
+    user_response = UserResponse(
+        id=user["id"],
+        nama_lengkap=user["nama_lengkap"],
+        email=user["email"],
+        nomor_whatsapp=user["nomor_whatsapp"],
+        created_at=user["created_at"]
+    )
+    
+    return Token(
+        access_token=access_token,
+        refresh_token=refresh_token,
+        token_type="bearer",
+        expires_in=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        user=user_response,
+    )
+
+@api_router.post("/auth/logout")
+async def logout(request: Optional[RefreshRequest] = None, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    try:
+        payload = await token_verifier.verify(credentials.credentials)
+    except InvalidToken:
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
+    await token_verifier.revoke(credentials.credentials, payload)
+    if request is not None:
+        await refresh_tokens.revoke(request.refresh_token)
+    return {"message": "Logged out successfully"}
 
 # Products endpoints
-@api_router.get("/products", response_model=List[Product])
-async def get_products(current_user: dict = Depends(get_current_user)):
-    products = await db.products.find().to_list(1000)
-    return [Product(**product) for product in products]
+@api_router.get("/products", response_model=List[ProductFields], response_model_exclude_unset=True)
+async def get_products(
+    request: Request,
+    response: Response,
+    limit: int = Query(1000, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+):
+    # Pagination is opt-in: without ?limit clients get the whole listing up to
+    # 1000 products as before, and only pass ?limit/?cursor to page through it
+    # Versions are read before the data so an ETag is never newer than its body
+    page_key = hashlib.sha1(f"{limit}|{cursor}|{fields}".encode()).hexdigest()[:8]
+    etag = f'"products-{catalog_cache.version("products")}-{page_key}"'
+    not_modified = check_not_modified(request, response, etag, CACHE_POLICIES["products"])
+    if not_modified:
+        return not_modified
+    
+    # Keyset pagination on (created_at, id); the next page cursor is sent in X-Next-Cursor
+    query = {}
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        query = {"$or": [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": last_id}},
+        ]}
+    projection = parse_fields(fields, PRODUCT_FIELDS, {"id", "created_at"}) or {"_id": 0}
+    products = await (
+        db.products.find(query, projection)
+        .sort([("created_at", 1), ("id", 1)])
+        .limit(limit + 1)
+        .to_list(limit + 1)
+    )
+    if len(products) > limit:
+        products = products[:limit]
+        last = products[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last["created_at"], last["id"])
+    if FAST_JSON:
+        return FastJSONResponse(PRODUCT_FIELDS_JSON.dumps_list(products), headers=response.headers)
+    return products
+
+@api_router.get("/products/search", response_model=List[Product])
+async def search_products(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user: dict = Depends(get_current_user),
+):
+    # Ranked results straight from the in-memory index; total hits go in X-Total-Count
+    total, products = search_index.search(q, limit=limit, offset=offset)
+    response.headers["X-Total-Count"] = str(total)
+    if FAST_JSON:
+        return FastJSONResponse(PRODUCT_JSON.dumps_list(products), headers=response.headers)
+    return products
 
 @api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str, current_user: dict = Depends(get_current_user)):
+async def get_product(product_id: str, request: Request, response: Response, current_user: dict = Depends(get_current_user)):
+    etag = f'"product-{catalog_cache.version("products")}-{product_id}"'
+    not_modified = check_not_modified(request, response, etag, CACHE_POLICIES["product"])
+    if not_modified:
+        return not_modified
+    
     product = await db.products.find_one({"id": product_id})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    if FAST_JSON:
+        return FastJSONResponse(PRODUCT_JSON.dumps(product), headers=response.headers)
     return Product(**product)
 
+@api_router.get("/trending", response_model=List[Product])
+async def get_trending(
+    request: Request,
+    response: Response,
+    limit: int = Query(20, ge=1, le=200),
+    current_user: dict = Depends(get_current_user),
+):
+    # Precomputed ranking held in memory; never aggregates on the request path
+    etag = f'"trending-{trending.version}-{limit}"'
+    not_modified = check_not_modified(request, response, etag, CACHE_POLICIES["trending"])
+    if not_modified:
+        return not_modified
+    
+    products = trending.get(limit)
+    if FAST_JSON:
+        return FastJSONResponse(PRODUCT_JSON.dumps_list(products), headers=response.headers)
+    return products
+
 # Categories endpoints
 @api_router.get("/categories", response_model=List[Category])
-async def get_categories(current_user: dict = Depends(get_current_user)):
-    categories = await db.categories.find().to_list(1000)
+async def get_categories(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
+    etag = f'"categories-{catalog_cache.version("categories")}"'
+    not_modified = check_not_modified(request, response, etag, CACHE_POLICIES["categories"])
+    if not_modified:
+        return not_modified
+    
+    categories = await catalog_cache.get_categories()
+    if FAST_JSON:
+        return FastJSONResponse(CATEGORY_JSON.dumps_list(categories), headers=response.headers)
     return [Category(**category) for category in categories]
 
 @api_router.get("/products/by-category/{category_name}")
-async def get_products_by_category(category_name: str, current_user: dict = Depends(get_current_user)):
-    products = await db.products.find({"kategori": category_name}).to_list(1000)
+async def get_products_by_category(category_name: str, request: Request, response: Response, current_user: dict = Depends(get_current_user)):
+    etag = f'"products-{catalog_cache.version("products")}"'
+    not_modified = check_not_modified(request, response, etag, CACHE_POLICIES["products"])
+    if not_modified:
+        return not_modified
+    
+    products = await catalog_cache.get_products_by_category(category_name)
+    if FAST_JSON:
+        return FastJSONResponse(PRODUCT_JSON.dumps_list(products), headers=response.headers)
     return [Product(**product) for product in products]
 
+# Home endpoint
+def product_card(product: dict) -> dict:
+    return {**product, "gambar": thumbnail_url(product["gambar"], CART_THUMBNAIL_SIZE)}
+
+async def build_home() -> Tuple[str, bytes, bool]:
+    now = datetime.utcnow()
+    card = {"_id": 0, **{field: 1 for field in ProductCard.model_fields}}
+    sections = {
+        "banners": db.banners.find({}, {"_id": 0}).sort("_id", 1).to_list(HOME_LIMITS["banners"]),
+        "brands": db.brands.find({}, {"_id": 0, "id": 1, "nama": 1, "logo": 1}).sort("nama", 1).to_list(HOME_LIMITS["brands"]),
+        "categories": catalog_cache.get_categories(),
+        "promotions": db.promotions.find(
+            {"active": True, "startDate": {"$lte": now}, "endDate": {"$gte": now}}, {"_id": 0}
+        ).to_list(HOME_LIMITS["promotions"]),
+        "products": db.products.find({}, card).sort([("created_at", -1), ("id", -1)]).to_list(HOME_LIMITS["products"]),
+    }
+    results = await asyncio.gather(*sections.values(), return_exceptions=True)
+    
+    content, complete = {}, True
+    for name, result in zip(sections, results):
+        if isinstance(result, Exception):
+            # One broken section shouldn't blank the whole home screen
+            logger.warning("Home section %s failed: %s", name, result)
+            result, complete = [], False
+        content[name] = result[:HOME_LIMITS[name]]
+    content["trending"] = trending.get(HOME_LIMITS["trending"])
+    for name in ("trending", "products"):
+        content[name] = [product_card(product) for product in content[name]]
+    
+    body = fast_json.dumps({
+        name: [HOME_SERIALIZERS[name].to_dict(doc) for doc in content[name]]
+        for name in HOME_SERIALIZERS
+    })
+    return f'"home-{hashlib.sha1(body).hexdigest()[:16]}"', body, complete
+
+@api_router.get("/home", response_model=Home)
+async def get_home(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
+    cached = home_cache.get("home")
+    if cached is None:
+        # Single-flight: concurrent cold starts share one rebuild
+        async with home_lock:
+            cached = home_cache.get("home")
+            if cached is None:
+                etag, body, complete = await build_home()
+                cached = (etag, body)
+                if complete:
+                    home_cache.set("home", cached)
+    
+    etag, body = cached
+    not_modified = check_not_modified(request, response, etag, CACHE_POLICIES["home"])
+    if not_modified:
+        return not_modified
+    return FastJSONResponse(body, headers=response.headers)
+
 # Cart endpoints
+async def hydrate_cart(cart: dict) -> Cart:
+    lines = cart.get("items", [])
+    products = await get_product_summaries([line["product_id"] for line in lines])
+    items = []
+    for line in lines:
+        product = products.get(line["product_id"])
+        if product is None:
+            # Product was removed from the catalog
+            continue
+        items.append(CartItem(
+            product_id=line["product_id"],
+            nama=product["nama"],
+            harga=product["harga"],
+            gambar=thumbnail_url(product["gambar"], CART_THUMBNAIL_SIZE),
+            quantity=line["quantity"],
+        ))
+    return Cart(
+        id=cart["id"],
+        user_id=cart["user_id"],
+        items=items,
+        total=sum(item.harga * item.quantity for item in items),
+        item_count=sum(item.quantity for item in items),
+        updated_at=cart["updated_at"]
+    )
+
+def new_cart_document(user_id: str) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "items": [],
+        "item_count": 0,
+        "version": uuid.uuid4().hex,
+        "updated_at": datetime.utcnow()
+    }
+
+def stored_cart_version(cart: dict) -> str:
+    # Carts written before versioning fall back to their last update time
+    return cart.get("version") or cart["updated_at"].isoformat()
+
+def remember_cart_version(cart: Optional[dict]):
+    if cart:
+        cart_versions.set(cart["user_id"], stored_cart_version(cart))
+
+def cart_etag(version: str, products_version: str) -> str:
+    # Hydrated carts include product names and prices, so the catalog version is part of the tag
+    return f'"cart-{version}-{products_version}"'
+
+async def apply_cart_update(user_id: str, ops: List[cart_updates.Op],
+                            upsert: bool = True) -> Tuple[Optional[dict], Optional[dict]]:
+    """Apply ``ops`` to the user's cart in one atomic round-trip; returns the cart before and after."""
+    cart_id, version = str(uuid.uuid4()), uuid.uuid4().hex
+    # MongoDB keeps milliseconds; truncate so the replayed cart matches the stored one
+    now = datetime.utcnow()
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    previous = await db.carts.find_one_and_update(
+        {"user_id": user_id},
+        cart_updates.op_stages(ops) + cart_updates.finalize(cart_id, version, now),
+        projection={"_id": 0},
+        upsert=upsert,
+        return_document=ReturnDocument.BEFORE,
+    )
+    if previous is None and not upsert:
+        return None, None
+    cart = cart_updates.apply_ops(previous, user_id, ops, cart_id, version, now)
+    remember_cart_version(cart)
+    invalidation_bus.publish("carts", user_id)
+    return previous, cart
+
 @api_router.get("/cart", response_model=Cart)
-async def get_cart(current_user: dict = Depends(get_current_user)):
+async def get_cart(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
+    products_version = catalog_cache.version("products")
+    
+    # Known version: answer If-None-Match without touching the database
+    version = cart_versions.get(current_user["id"])
+    if version:
+        etag = cart_etag(version, products_version)
+        not_modified = check_not_modified(request, response, etag, CACHE_POLICIES["cart"])
+        if not_modified:
+            return not_modified
+    
     cart = await db.carts.find_one({"user_id": current_user["id"]})
     if not cart:
         # Create empty cart if doesn't exist
-        empty_cart = Cart(user_id=current_user["id"])
-        await db.carts.insert_one(empty_cart.dict())
-        return empty_cart
-    return Cart(**cart)
+        cart = new_cart_document(current_user["id"])
+        await db.carts.insert_one(cart)
+    remember_cart_version(cart)
+    
+    # Still skip hydration and serialization when the stored version matches
+    etag = cart_etag(stored_cart_version(cart), products_version)
+    not_modified = check_not_modified(request, response, etag, CACHE_POLICIES["cart"])
+    if not_modified:
+        return not_modified
+    return await hydrate_cart(cart)
 
 @api_router.post("/cart/add")
 async def add_to_cart(product_id: str, quantity: int = 1, current_user: dict = Depends(get_current_user)):
-    # Get product details
-    product = await db.products.find_one({"id": product_id})
-    if not product:
+    # Check the product exists
+    products = await get_product_summaries([product_id])
+    if product_id not in products:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Get or create cart
-    cart = await db.carts.find_one({"user_id": current_user["id"]})
-    if not cart:
-        cart = Cart(user_id=current_user["id"]).dict()
-        await db.carts.insert_one(cart)
-    
-    # Check if item already in cart
-    item_exists = False
-    for item in cart.get("items", []):
-        if item["product_id"] == product_id:
-            item["quantity"] += quantity
-            item_exists = True
-            break
-    
-    if not item_exists:
-        new_item = CartItem(
-            product_id=product_id,
-            nama=product["nama"],
-            harga=product["harga"],
-            gambar=product["gambar"],
-            quantity=quantity
-        )
-        cart.setdefault("items", []).append(new_item.dict())
-    
-    # Calculate total
-    total = sum(item["harga"] * item["quantity"] for item in cart["items"])
-    cart["total"] = total
-    cart["updated_at"] = datetime.utcnow()
-    
-    await db.carts.update_one(
-        {"user_id": current_user["id"]},
-        {"$set": cart}
-    )
+    # Take the quantity out of stock first; a sold-out product never reaches the cart
+    if quantity > 0:
+        await stock_reservations.reserve(current_user["id"], product_id, quantity)
+    try:
+        # Creates the cart or line if needed and increments the quantity atomically
+        previous, cart = await apply_cart_update(current_user["id"], [("increment", product_id, quantity)])
+    except Exception:
+        if quantity > 0:
+            await stock_reservations.release(current_user["id"], product_id, quantity)
+        raise
+    # A negative quantity can remove less than asked if the line was smaller
+    removed = -cart_updates.line_changes(previous, cart).get(product_id, 0)
+    if removed > 0:
+        await stock_reservations.release(current_user["id"], product_id, removed)
+    trending.record_cart_adds({product_id: quantity})
     
-    return {"message": "Item added to cart", "cart": Cart(**cart)}
+    return {"message": "Item added to cart", "cart": await hydrate_cart(cart)}
 
 @api_router.delete("/cart/remove/{product_id}")
 async def remove_from_cart(product_id: str, current_user: dict = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": current_user["id"]})
+    _, cart = await apply_cart_update(current_user["id"], [("remove", product_id, 0)], upsert=False)
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
+    await stock_reservations.release(current_user["id"], product_id)
     
-    # Remove item from cart
-    cart["items"] = [item for item in cart["items"] if item["product_id"] != product_id]
+    return {"message": "Item removed from cart", "cart": await hydrate_cart(cart)}
+
+@api_router.patch("/cart", response_model=Cart)
+async def patch_cart(patch: CartPatch, current_user: dict = Depends(get_current_user)):
+    if any(op.op == "set" and op.quantity < 0 for op in patch.operations):
+        raise HTTPException(status_code=400, detail="Quantity cannot be negative")
     
-    # Recalculate total
-    total = sum(item["harga"] * item["quantity"] for item in cart["items"])
-    cart["total"] = total
-    cart["updated_at"] = datetime.utcnow()
+    # Validate every product the batch adds with one lookup
+    added_ids = [op.product_id for op in patch.operations if op.op != "remove"]
+    products = await get_product_summaries(added_ids)
+    missing = sorted(set(added_ids) - set(products))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Product not found: {', '.join(missing)}")
     
-    await db.carts.update_one(
-        {"user_id": current_user["id"]},
-        {"$set": cart}
+    # All operations are applied by one atomic update; reservations follow what it actually changed
+    ops = [(op.op, op.product_id, op.quantity) for op in patch.operations]
+    previous, cart = await apply_cart_update(current_user["id"], ops)
+    changes = cart_updates.line_changes(previous, cart)
+    try:
+        await stock_reservations.adjust(current_user["id"], changes)
+    except InsufficientStock:
+        # Increments commute with concurrent updates, so this undoes only our own changes
+        await apply_cart_update(current_user["id"], [("increment", product_id, -change) for product_id, change in changes.items()])
+        raise
+    trending.record_cart_adds(changes)
+    return await hydrate_cart(cart)
+
+# Order endpoints
+class CartChanged(Exception):
+    pass
+
+_transactions_supported: Optional[bool] = None
+
+async def transactions_supported() -> bool:
+    # Multi-document transactions need a replica set or mongos
+    global _transactions_supported
+    if _transactions_supported is None:
+        hello = await mongo.client.admin.command("hello")
+        _transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+    return _transactions_supported
+
+async def place_order(user_id: str, checkout: CheckoutRequest, session=None) -> dict:
+    cart = await db.carts.find_one({"user_id": user_id}, session=session)
+    lines = (cart or {}).get("items", [])
+    if not lines:
+        raise HTTPException(status_code=400, detail="Keranjang kosong")
+
+    # Prices are read fresh, not from the product cache, since they are frozen into the order
+    product_ids = [line["product_id"] for line in lines]
+    products = {
+        product["id"]: product
+        async for product in db.products.find({"id": {"$in": product_ids}}, PRODUCT_SUMMARY_PROJECTION, session=session)
+    }
+    items = [
+        OrderItem(
+            product_id=line["product_id"],
+            nama=products[line["product_id"]]["nama"],
+            harga=products[line["product_id"]]["harga"],
+            gambar=products[line["product_id"]]["gambar"],
+            quantity=line["quantity"],
+        )
+        for line in lines if line["product_id"] in products
+    ]
+    if not items:
+        raise HTTPException(status_code=400, detail="Produk di keranjang sudah tidak tersedia")
+    # Re-take any reservation that lapsed while the items sat in the cart
+    await stock_reservations.hold(user_id, {item.product_id: item.quantity for item in items}, session)
+    subtotal = sum(item.harga * item.quantity for item in items)
+    order = Order(
+        user_id=user_id,
+        items=items,
+        subtotal=subtotal,
+        ongkos_kirim=checkout.ongkos_kirim,
+        total=subtotal + checkout.ongkos_kirim,
+        **checkout.dict(exclude={"ongkos_kirim"}),
+    ).dict()
+
+    await db.orders.insert_one(order, session=session)
+    # Only empty the cart we priced; a concurrent change means the order is stale
+    result = await db.carts.update_one(
+        {"user_id": user_id, "version": cart.get("version")},
+        cart_updates.clear_lines() + cart_updates.finalize(str(uuid.uuid4()), uuid.uuid4().hex, datetime.utcnow()),
+        session=session,
+    )
+    if result.matched_count == 0:
+        if session is None:
+            # No transaction to roll back, so undo the insert ourselves
+            await db.orders.delete_one({"id": order["id"]})
+        raise CartChanged()
+    await stock_reservations.consume(user_id, {item.product_id: item.quantity for item in items}, session)
+    order.pop("_id", None)
+    return order
+
+@api_router.post("/orders", response_model=Order)
+async def create_order(checkout: CheckoutRequest, current_user: dict = Depends(get_current_user)):
+    user_id = current_user["id"]
+    try:
+        if await transactions_supported():
+            # The order insert and cart clear commit together or not at all
+            async with await mongo.client.start_session() as session:
+                order = await session.with_transaction(lambda s: place_order(user_id, checkout, s))
+        else:
+            order = await place_order(user_id, checkout)
+    except CartChanged:
+        raise HTTPException(status_code=409, detail="Keranjang berubah, silakan coba lagi")
+    finally:
+        invalidation_bus.invalidate("carts", user_id)
+    return order
+
+@api_router.get("/orders", response_model=List[Order])
+async def get_orders(
+    response: Response,
+    status_filter: Optional[List[str]] = Query(None, alias="status"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user),
+):
+    # Newest first, keyset-paginated on the (user_id, created_at, id) index
+    query = {"user_id": current_user["id"]}
+    if status_filter:
+        unknown = set(status_filter) - set(ORDER_STATUSES)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown status: {', '.join(sorted(unknown))}")
+        query["status"] = {"$in": status_filter}
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": last_id}},
+        ]
+    orders = await (
+        db.orders.find(query, {"_id": 0})
+        .sort([("created_at", -1), ("id", -1)])
+        .limit(limit + 1)
+        .to_list(limit + 1)
+    )
+    if len(orders) > limit:
+        orders = orders[:limit]
+        last = orders[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last["created_at"], last["id"])
+    return orders
+
+@api_router.get("/orders/{order_id}", response_model=Order)
+async def get_order(order_id: str, current_user: dict = Depends(get_current_user)):
+    order = await db.orders.find_one({"id": order_id, "user_id": current_user["id"]}, {"_id": 0})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return order
+
+@api_router.put("/orders/{order_id}/cancel", response_model=Order)
+async def cancel_order(order_id: str, current_user: dict = Depends(get_current_user)):
+    # Only pending orders can be cancelled; the status check is part of the update
+    order = await db.orders.find_one_and_update(
+        {"id": order_id, "user_id": current_user["id"], "status": "pending"},
+        {"$set": {"status": "cancelled", "updated_at": datetime.utcnow()}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
     )
+    if not order:
+        if await db.orders.count_documents({"id": order_id, "user_id": current_user["id"]}, limit=1):
+            raise HTTPException(status_code=400, detail="Pesanan tidak dapat dibatalkan")
+        raise HTTPException(status_code=404, detail="Order not found")
+    await stock_reservations.restock(order["items"])
+    return order
+
+# Image endpoints
+@api_router.get("/images/{digest}")
+async def get_image(digest: str, request: Request, size: Optional[int] = None):
+    if not DIGEST_RE.match(digest):
+        raise HTTPException(status_code=404, detail="Image not found")
+    if size is not None and size not in image_store.thumbnail_sizes:
+        raise HTTPException(status_code=400, detail=f"Size must be one of {list(image_store.thumbnail_sizes)}")
+    
+    # Content never changes for a digest, so the ETag can be answered without reading the blob
+    etag = f'"{digest}-{size}"' if size else f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    blob = await image_store.get(digest, size)
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    data, content_type = blob
+    
+    range_header = request.headers.get("range")
+    if range_header:
+        byte_range = parse_range(range_header, len(data))
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{len(data)}"})
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        return Response(data[start:end + 1], status_code=206, media_type=content_type, headers=headers)
     
-    return {"message": "Item removed from cart", "cart": Cart(**cart)}
+    return Response(data, media_type=content_type, headers=headers)
 
 # Profile endpoints
 @api_router.get("/profile", response_model=UserResponse)
-async def get_profile(current_user: dict = Depends(get_current_user)):
+async def get_profile(current_user: dict = Depends(get_current_user_record)):
     return UserResponse(
         id=current_user["id"],
         nama_lengkap=current_user["nama_lengkap"],
@@ -299,9 +1136,111 @@ async def update_profile(profile_data: dict, current_user: dict = Depends(get_cu
             {"id": current_user["id"]},
             {"$set": update_data}
         )
+        invalidation_bus.invalidate("users", current_user["email"])
     
+    # Access tokens already issued keep the old name and number until the client refreshes
     return {"message": "Profile updated successfully"}
 
+# Status endpoints
+@api_router.get("/status/hashing")
+async def hashing_status():
+    return password_hasher.stats()
+
+@api_router.get("/status/caches")
+async def cache_status():
+    return {
+        "users": user_cache.stats(),
+        "tokens": token_verifier.stats(),
+        "products": product_cache.stats(),
+        "catalog": catalog_cache.stats(),
+        "trending": trending.stats(),
+        "home": home_cache.stats(),
+        "invalidation": invalidation_bus.stats(),
+    }
+
+@api_router.get("/status/ready")
+async def readiness(response: Response):
+    pools = mongo_pool_metrics.snapshot()
+    try:
+        ping_ms = await mongo.ping(timeout=float(os.environ.get('READINESS_TIMEOUT', 2))) * 1000
+        if index_check["missing"]:
+            # Look again, so the worker turns ready once someone runs indexes.py
+            await check_indexes()
+    except (PyMongoError, asyncio.TimeoutError, RuntimeError) as e:
+        ping_ms, error = None, str(e) or type(e).__name__
+    else:
+        error = None
+    ready = error is None and mongo.warmed_up and not index_check["missing"]
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    max_pool_size = mongo.client_options["maxPoolSize"]
+    return {
+        "ready": ready,
+        "warmed_up": mongo.warmed_up,
+        "ping_ms": ping_ms,
+        "error": error,
+        "missing_indexes": index_check["missing"],
+        "pool": {
+            "max_size": max_pool_size,
+            "min_size": mongo.client_options["minPoolSize"],
+            "servers": {
+                address: {**pool, "utilization": pool["checked_out"] / max_pool_size}
+                for address, pool in pools.items()
+            },
+        },
+    }
+
+@api_router.get("/status/reservations")
+async def reservation_status():
+    return stock_reservations.stats()
+
+# Admin endpoints (X-Admin-Token header)
+class ProfilingToggle(BaseModel):
+    enabled: bool
+
+@api_router.get("/admin/slow-requests", dependencies=[Depends(require_admin)])
+async def slow_requests():
+    return {"profiling": profiler.stats(), "requests": profiler.recent_slow_requests()}
+
+@api_router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def request_profiles():
+    return {"profiling": profiler.stats(), "minutes": profiler.profiles()}
+
+@api_router.put("/admin/profiling", dependencies=[Depends(require_admin)])
+async def toggle_profiling(toggle: ProfilingToggle):
+    profiler.set_sampling(toggle.enabled)
+    return profiler.stats()
+
+@metrics.collector
+def service_metrics():
+    hashing = password_hasher.stats()
+    yield MetricFamily("bcrypt_queue_depth", "gauge", "Password hashing jobs waiting for a worker", [({}, hashing["queue_depth"])])
+    yield MetricFamily("bcrypt_in_flight", "gauge", "Password hashing jobs running", [({}, hashing["in_flight"])])
+    yield MetricFamily("bcrypt_jobs_total", "counter", "Password hashing jobs by outcome", [
+        ({"outcome": "completed"}, hashing["completed"]),
+        ({"outcome": "rejected"}, hashing["rejected"]),
+    ])
+    yield from cache_families({
+        "users": user_cache.stats(),
+        "tokens": token_verifier.cache.stats(),
+        "products": product_cache.stats(),
+        "home": home_cache.stats(),
+        "catalog_by_category": catalog_cache.stats()["by_category"],
+    })
+    reservations = stock_reservations.stats()
+    yield MetricFamily("stock_reservation_units_total", "counter", "Stock units reserved, released or rejected", [
+        ({"event": event}, reservations[event]) for event in ("reserved", "released", "rejected")
+    ])
+    yield MetricFamily("stock_reservations_total", "counter", "Reservations closed by expiry or checkout", [
+        ({"event": event}, reservations[event]) for event in ("expired", "consumed")
+    ])
+    yield MetricFamily("token_revocation_lookups_total", "counter", "Revocation filter hits confirmed against MongoDB",
+                       [({}, token_verifier.lookups)])
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -311,8 +1250,14 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "ETag"],
 )
 
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+# Outermost, so latency covers the whole stack
+app.add_middleware(MetricsMiddleware, metrics=request_metrics)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -320,53 +1265,46 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
+def open_database():
+    global image_store
+    mongo.open()
+    image_store = create_image_store(mongo.database, os.environ.get('IMAGE_STORE', 'local'), os.environ.get('IMAGE_STORE_PATH'))
+
+# Required indexes absent from the database, by collection; the worker is unready while any are
+index_check = {"missing": {}}
+
+async def check_indexes():
+    missing = await missing_indexes(db)
+    if missing and missing != index_check["missing"]:
+        logger.error("MongoDB indexes missing: %s. Run `python indexes.py` or `python seed.py`; "
+                     "until then carts, reservations and TTL cleanup are unsafe", missing)
+    index_check["missing"] = missing
+
 async def shutdown_db_client():
-    client.close()
+    await catalog_cache.stop()
+    await stock_reservations.stop()
+    await trending.stop()
+    await token_verifier.stop()
+    await invalidation_bus.stop()
+    profiler.set_sampling(False)
+    mongo.close()
+    password_hasher.shutdown()
 
-# Add some sample data on startup
-@app.on_event("startup")
 async def startup_event():
-    # Create sample categories
-    sample_categories = [
-        {"id": str(uuid.uuid4()), "nama": "Elektronik", "created_at": datetime.utcnow()},
-        {"id": str(uuid.uuid4()), "nama": "Fashion", "created_at": datetime.utcnow()},
-        {"id": str(uuid.uuid4()), "nama": "Makanan", "created_at": datetime.utcnow()},
-        {"id": str(uuid.uuid4()), "nama": "Kesehatan", "created_at": datetime.utcnow()}
-    ]
-    
-    for category in sample_categories:
-        existing = await db.categories.find_one({"nama": category["nama"]})
-        if not existing:
-            await db.categories.insert_one(category)
-    
-    # Create sample products
-    sample_products = [
-        {
-            "id": str(uuid.uuid4()),
-            "nama": "Smartphone Android",
-            "deskripsi": "Smartphone terbaru dengan kamera canggih",
-            "harga": 2500000.0,
-            "gambar": "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==",
-            "kategori": "Elektronik",
-            "stok": 50,
-            "created_at": datetime.utcnow()
-        },
-        {
-            "id": str(uuid.uuid4()),
-            "nama": "T-Shirt Cotton",
-            "deskripsi": "T-Shirt berbahan cotton premium",
-            "harga": 150000.0,
-            "gambar": "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==",
-            "kategori": "Fashion",
-            "stok": 100,
-            "created_at": datetime.utcnow()
-        }
-    ]
-    
-    for product in sample_products:
-        existing = await db.products.find_one({"nama": product["nama"]})
-        if not existing:
-            await db.products.insert_one(product)
-    
-    logger.info("Startup completed - Sample data loaded")
\ No newline at end of file
+    open_database()
+    # Fill the pool before the worker is handed any traffic
+    await mongo.warm_up(min(MONGO_WARMUP_CONNECTIONS, mongo.client_options["maxPoolSize"]))
+    # Indexes and sample data are set up before workers start: serve.py does it, and anything
+    # else that runs `uvicorn server:app` (supervisor, containers) must run `python indexes.py`
+    # or `python seed.py` first. Carts, reservations and TTL cleanup rely on those indexes.
+    await check_indexes()
+    await invalidation_bus.start()
+    await search_index.load(db)
+    await catalog_cache.start()
+    await stock_reservations.start()
+    await trending.start()
+    await token_verifier.start()
+    # The sampler watches the thread that starts it, so this must run on the event loop
+    if os.environ.get('PROFILE_SAMPLING', 'false').lower() == 'true':
+        profiler.set_sampling(True)
+    logger.info("Startup completed")
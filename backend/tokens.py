@@ -0,0 +1,242 @@
+"""Access-token verification without a database round-trip per request.
+
+Verified claims are cached per token, keyed by the token's SHA-256 digest,
+until the token's ``exp``. A cache hit skips the HMAC check and claim
+validation entirely.
+
+Revoked token ids are stored in ``revoked_tokens``, with a TTL index that
+drops each entry once the token would have expired anyway. Every worker
+mirrors the collection in a Bloom filter. It loads the filter at startup and
+adds new revocations every ``sync_interval``. A token whose id is not in the
+filter is certainly not revoked, which is the answer for nearly every
+request. A hit might be a false positive, so it is confirmed against
+``revoked_tokens`` and the answer is cached briefly.
+
+Access tokens are short-lived. A long-lived refresh token exchanges for a new
+pair through ``RefreshTokens.rotate``, and each refresh token works once. A
+token presented again within a few seconds of its rotation is a retried
+request or a second tab: it gets the same successor again. Presenting it
+later means it leaked, and the whole family of tokens descended from that
+login is revoked.
+
+PyJWT (and the cryptography package it loads) is imported on first use rather
+than with the module, keeping it out of worker startup.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import secrets
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from cache import BloomFilter, TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Re-read revocations this far behind the last sync, so clock skew between workers can't hide one
+SYNC_OVERLAP = timedelta(seconds=30)
+
+
+class InvalidToken(Exception):
+    """The token is malformed, badly signed, expired or revoked."""
+
+
+def token_id(token: str, claims: dict) -> str:
+    """The id revocations are recorded under: ``jti``, or the token digest for tokens without one."""
+    return claims.get("jti") or hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenVerifier:
+    def __init__(self, db, secret: str, algorithm: str, cache_size: int = 10000,
+                 capacity: int = 100000, error_rate: float = 0.001, sync_interval: float = 5.0):
+        self.db = db
+        self.secret = secret
+        self.algorithm = algorithm
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.cache = TTLCache(maxsize=cache_size, ttl=float("inf"))
+        # Confirmed answers for Bloom filter hits, so a revoked token being retried doesn't hit Mongo each time
+        self._confirmed = TTLCache(maxsize=cache_size, ttl=sync_interval)
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._synced_at = datetime.utcnow()
+        self._task: Optional[asyncio.Task] = None
+        self.lookups = 0
+
+    def encode(self, claims: dict) -> str:
+        import jwt
+
+        return jwt.encode(claims, self.secret, algorithm=self.algorithm)
+
+    async def verify(self, token: str) -> dict:
+        """Return the token's claims; raises ``InvalidToken`` if it is invalid, expired or revoked."""
+        digest = hashlib.sha256(token.encode()).digest()
+        claims = self.cache.get(digest)
+        if claims is None:
+            import jwt
+
+            try:
+                claims = jwt.decode(token, self.secret, algorithms=[self.algorithm])
+            except jwt.PyJWTError as e:
+                raise InvalidToken(str(e)) from e
+            ttl = claims["exp"] - time.time() if "exp" in claims else None
+            self.cache.set(digest, claims, ttl)
+        elif "exp" in claims and claims["exp"] <= time.time():
+            # The cache drops the entry at exp by itself; this covers clock adjustments
+            raise InvalidToken("Signature has expired")
+        if await self.is_revoked(token_id(token, claims)):
+            raise InvalidToken("Token has been revoked")
+        return claims
+
+    async def is_revoked(self, jti: str) -> bool:
+        if jti not in self._bloom:
+            return False
+        revoked = self._confirmed.get(jti)
+        if revoked is None:
+            self.lookups += 1
+            revoked = await self.db.revoked_tokens.find_one({"_id": jti}, {"_id": 1}) is not None
+            self._confirmed.set(jti, revoked)
+        return revoked
+
+    async def revoke(self, token: str, claims: dict):
+        jti = token_id(token, claims)
+        now = datetime.utcnow()
+        expires_at = datetime.utcfromtimestamp(claims["exp"]) if "exp" in claims else datetime.max
+        try:
+            await self.db.revoked_tokens.insert_one({"_id": jti, "revoked_at": now, "expires_at": expires_at})
+        except DuplicateKeyError:
+            pass
+        # Takes effect here at once; other workers pick it up on their next sync
+        self._bloom.add(jti)
+        self._confirmed.set(jti, True)
+
+    # Revocation list sync
+
+    async def load(self):
+        """Rebuild the Bloom filter from every revocation that hasn't expired yet."""
+        now = datetime.utcnow()
+        live = {"expires_at": {"$gt": now}}
+        count = await self.db.revoked_tokens.count_documents(live)
+        bloom = BloomFilter(max(self.capacity, count * 2), self.error_rate)
+        async for revoked in self.db.revoked_tokens.find(live, {"_id": 1}):
+            bloom.add(revoked["_id"])
+        self._bloom = bloom
+        self._synced_at = now
+
+    async def sync(self):
+        now = datetime.utcnow()
+        async for revoked in self.db.revoked_tokens.find({"revoked_at": {"$gte": self._synced_at - SYNC_OVERLAP}}, {"_id": 1}):
+            self._bloom.add(revoked["_id"])
+        self._synced_at = now
+        if self._bloom.count > self._bloom.capacity:
+            # Past capacity the false positive rate climbs; resize (expired entries drop out too)
+            await self.load()
+
+    def stats(self) -> dict:
+        return {
+            "cache": self.cache.stats(),
+            "revocations": self._bloom.stats(),
+            "revocation_lookups": self.lookups,
+            "synced_at": self._synced_at.isoformat(),
+        }
+
+    async def start(self):
+        try:
+            await self.load()
+        except PyMongoError as e:
+            logger.warning("Loading revoked tokens failed: %s", e)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except PyMongoError as e:
+                logger.warning("Syncing revoked tokens failed: %s", e)
+
+
+class RefreshTokens:
+    """Opaque, single-use refresh tokens in ``refresh_tokens``; only their SHA-256 is stored."""
+
+    def __init__(self, db, secret: str, ttl: timedelta = timedelta(days=30),
+                 reuse_grace: timedelta = timedelta(seconds=10)):
+        self.db = db
+        self.secret = secret.encode()
+        self.ttl = ttl
+        self.reuse_grace = reuse_grace
+
+    @staticmethod
+    def _digest(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def _successor(self, token: str) -> str:
+        # Derived rather than random, so presenting a token twice yields the same successor
+        mac = hmac.new(self.secret, token.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(mac).rstrip(b"=").decode()
+
+    async def _insert(self, token: str, user_id: str, family: str):
+        now = datetime.utcnow()
+        await self.db.refresh_tokens.insert_one({
+            "_id": self._digest(token),
+            "user_id": user_id,
+            # Every token rotated from the same login shares the family of the first
+            "family": family,
+            "created_at": now,
+            "expires_at": now + self.ttl,
+            "rotated_at": None,
+        })
+
+    async def issue(self, user_id: str) -> str:
+        """Start a new family with a fresh token, e.g. at login."""
+        token = secrets.token_urlsafe(32)
+        await self._insert(token, user_id, secrets.token_hex(16))
+        return token
+
+    async def rotate(self, token: str) -> Optional[Tuple[dict, str]]:
+        """Spend ``token``; returns its record and the successor token, or None if it is unknown, expired or stolen."""
+        now = datetime.utcnow()
+        digest = self._digest(token)
+        record = await self.db.refresh_tokens.find_one_and_update(
+            {"_id": digest, "rotated_at": None, "expires_at": {"$gt": now}},
+            {"$set": {"rotated_at": now}},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if record is None:
+            record = await self.db.refresh_tokens.find_one({"_id": digest, "rotated_at": {"$ne": None}})
+            if record is None:
+                return None
+            if now - record["rotated_at"] > self.reuse_grace:
+                logger.warning("Refresh token reused; revoking its family %s", record["family"])
+                await self.revoke_family(record["family"])
+                return None
+            # A retry after a lost response, or another tab refreshing at the same moment
+        successor = self._successor(token)
+        try:
+            await self._insert(successor, record["user_id"], record["family"])
+        except DuplicateKeyError:
+            # Already issued to the first presentation
+            pass
+        return record, successor
+
+    async def revoke(self, token: str):
+        record = await self.db.refresh_tokens.find_one({"_id": self._digest(token)}, {"family": 1})
+        if record is not None:
+            await self.revoke_family(record["family"])
+
+    async def revoke_family(self, family: str):
+        await self.db.refresh_tokens.delete_many({"family": family})
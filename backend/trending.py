@@ -0,0 +1,198 @@
+"""Precomputed trending-products ranking.
+
+Every product is scored on how often it is added to carts and ordered
+recently. Each cart add and each order line contributes its quantity times a
+weight, and that contribution halves every ``half_life``. One aggregation
+pipeline computes the scores and ``$out``s them to the materialized
+``trending_products`` collection. A background task re-runs the pipeline
+every ``refresh_interval``; a worker skips the run if another worker's
+ranking is still fresh. Cart adds are buffered in memory and written to
+``cart_events`` every ``flush_interval``, so adding to the cart costs no
+extra database round trip. While writes fail, at most ``max_buffered``
+events are kept and the oldest are dropped. Requests are served from the ranked product list
+held in memory, so the home screen never triggers an aggregation.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+CART_ADD_WEIGHT = 1.0
+ORDER_LINE_WEIGHT = 3.0
+
+
+class TrendingService:
+    def __init__(self, db, refresh_interval: float = 300.0, half_life: timedelta = timedelta(days=3),
+                 window: timedelta = timedelta(days=14), size: int = 200, flush_interval: float = 5.0, max_buffered: int = 10000):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.half_life = half_life
+        self.window = window
+        self.size = size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.dropped_cart_adds = 0
+        self.version = self._version([], None)
+        self.refreshed_at: Optional[datetime] = None
+        self._products: List[dict] = []
+        self._stale = False
+        self._events: List[dict] = []
+        self._flush: Optional[asyncio.Task] = None
+        self._reload: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, limit: int) -> List[dict]:
+        return self._products[:limit]
+
+    def record_cart_adds(self, quantities: Dict[str, int]):
+        now = datetime.utcnow()
+        self._events += [
+            {"product_id": product_id, "quantity": quantity, "at": now}
+            for product_id, quantity in quantities.items() if quantity > 0
+        ]
+        self._trim_events()
+
+    def _trim_events(self):
+        overflow = len(self._events) - self.max_buffered
+        if overflow > 0:
+            # Old adds have decayed the most; lose those first
+            del self._events[:overflow]
+            self.dropped_cart_adds += overflow
+
+    async def flush_cart_adds(self):
+        """Write the buffered cart adds to ``cart_events``."""
+        events, self._events = self._events, []
+        if not events:
+            return
+        try:
+            await self.db.cart_events.insert_many(events, ordered=False)
+        except PyMongoError as e:
+            # Keep them for the next flush rather than losing the signal
+            logger.warning("Writing %d cart events failed: %s", len(events), e)
+            self._events[:0] = events
+            self._trim_events()
+
+    def pipeline(self, now: datetime) -> List[dict]:
+        since = now - self.window
+        half_life_ms = self.half_life.total_seconds() * 1000
+        return [
+            {"$match": {"created_at": {"$gte": since}, "status": {"$ne": "cancelled"}}},
+            {"$unwind": "$items"},
+            {"$project": {
+                "_id": 0,
+                "product_id": "$items.product_id",
+                "weight": {"$multiply": ["$items.quantity", ORDER_LINE_WEIGHT]},
+                "at": "$created_at",
+            }},
+            {"$unionWith": {"coll": "cart_events", "pipeline": [
+                {"$match": {"at": {"$gte": since}}},
+                {"$project": {
+                    "_id": 0,
+                    "product_id": 1,
+                    "weight": {"$multiply": ["$quantity", CART_ADD_WEIGHT]},
+                    "at": 1,
+                }},
+            ]}},
+            {"$group": {
+                "_id": "$product_id",
+                "score": {"$sum": {"$multiply": [
+                    "$weight",
+                    {"$pow": [0.5, {"$divide": [{"$subtract": [now, "$at"]}, half_life_ms]}]},
+                ]}},
+            }},
+            {"$sort": {"score": -1, "_id": 1}},
+            {"$limit": self.size},
+            {"$set": {"product_id": "$_id", "refreshed_at": now}},
+            {"$out": "trending_products"},
+        ]
+
+    async def refresh(self):
+        """Recompute the ranking into ``trending_products``."""
+        await self.db.orders.aggregate(self.pipeline(datetime.utcnow())).to_list(None)
+
+    async def load(self):
+        """Load the materialized ranking and its products into memory."""
+        ranking = await self.db.trending_products.find({}, {"_id": 0}).sort([("score", -1), ("product_id", 1)]).to_list(self.size)
+        ids = [entry["product_id"] for entry in ranking]
+        products = {product["id"]: product async for product in self.db.products.find({"id": {"$in": ids}}, {"_id": 0})}
+        ranked = [products[product_id] for product_id in ids if product_id in products]
+        if len(ranked) < self.size:
+            # Too little activity yet; fill up with the rest of the catalog by name
+            ranked += await self.db.products.find({"id": {"$nin": ids}}, {"_id": 0}).sort("nama", 1).to_list(self.size - len(ranked))
+        self._products = ranked
+        self.refreshed_at = ranking[0]["refreshed_at"] if ranking else None
+        self.version = self._version(ranked, self.refreshed_at)
+
+    @staticmethod
+    def _version(products: List[dict], refreshed_at: Optional[datetime]) -> str:
+        # Derived from what is served, so every worker holding the same ranking sends the same ETag
+        content = json.dumps([refreshed_at, products], sort_keys=True, default=str)
+        return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+    def products_changed(self):
+        """Reload product details (price, stock) without recomputing the ranking."""
+        self._stale = True
+        if self._reload is None or self._reload.done():
+            self._reload = asyncio.create_task(self._reload_products())
+
+    async def _reload_products(self):
+        # Coalesces a burst of product changes into as few reloads as possible
+        while self._stale:
+            self._stale = False
+            try:
+                await self.load()
+            except PyMongoError as e:
+                logger.warning("Reloading trending products failed: %s", e)
+
+    def stats(self) -> dict:
+        return {
+            "products": len(self._products),
+            "refreshed_at": self.refreshed_at.isoformat() if self.refreshed_at else None,
+            "version": self.version,
+            "buffered_cart_adds": len(self._events),
+            "dropped_cart_adds": self.dropped_cart_adds,
+        }
+
+    # Background refresh
+
+    async def start(self):
+        # Serve the last materialized ranking right away; the refresh runs in the background
+        try:
+            await self.load()
+        except PyMongoError as e:
+            logger.warning("Loading trending products failed: %s", e)
+        self._task = asyncio.create_task(self._run())
+        self._flush = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        for task in (self._task, self._flush, self._reload):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        await self.flush_cart_adds()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_cart_adds()
+
+    async def _run(self):
+        while True:
+            try:
+                latest = await self.db.trending_products.find_one({}, {"_id": 0, "refreshed_at": 1})
+                age = datetime.utcnow() - latest["refreshed_at"] if latest else None
+                if age is None or age.total_seconds() >= self.refresh_interval:
+                    await self.refresh()
+                await self.load()
+            except PyMongoError as e:
+                logger.warning("Trending refresh failed: %s", e)
+            await asyncio.sleep(self.refresh_interval)
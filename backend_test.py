@@ -9,6 +9,7 @@ import requests
 import json
 import sys
 import os
+import subprocess
 from datetime import datetime
 
 # Get backend URL from frontend .env file
@@ -36,6 +37,7 @@ TEST_USER = {
 # Global variables for test state
 auth_token = None
 test_product_id = None
+test_order_id = None
 test_results = []
 
 def log_test(test_name, success, message="", response_data=None):
@@ -394,78 +396,145 @@ def test_update_profile():
         log_test("Update Profile", False, f"Request failed: {str(e)}")
         return False
 
+def get_product_stock(headers):
+    """Current stok of the test product"""
+    response = requests.get(f"{BASE_URL}/products/{test_product_id}", headers=headers, timeout=10)
+    return response.json()["stok"]
+
+def place_test_order(headers):
+    """Put one unit of the test product in the cart and check out"""
+    response = requests.post(f"{BASE_URL}/cart/add", headers=headers, params={"product_id": test_product_id, "quantity": 1}, timeout=10)
+    if response.status_code != 200:
+        return response
+    checkout = {
+        "nama_penerima": TEST_USER["nama_lengkap"],
+        "alamat": "Jl. Merdeka No. 1, Jakarta",
+        "nomor_whatsapp": TEST_USER["nomor_whatsapp"],
+        "metode_pembayaran": "transfer",
+    }
+    return requests.post(f"{BASE_URL}/orders", headers=headers, json=checkout, timeout=10)
+
 def test_firebase_order_endpoints():
-    """Test Firebase-related order management endpoints"""
-    print("\n=== Testing Firebase Order Management Endpoints ===")
+    """Test order creation, listing and lookup"""
+    global test_order_id
+    print("\n=== Testing Order Management Endpoints ===")
     
     if not auth_token:
-        log_test("Firebase Order Endpoints", False, "No auth token available")
+        log_test("Order Endpoints", False, "No auth token available")
+        return False
+        
+    if not test_product_id:
+        log_test("Order Endpoints", False, "No product ID available for testing")
         return False
     
     headers = {"Authorization": f"Bearer {auth_token}"}
     
-    # Test order creation endpoint
+    # Checkout with an empty cart is refused
     try:
-        response = requests.post(f"{BASE_URL}/orders", headers=headers, timeout=10)
-        if response.status_code == 404:
-            log_test("Order Creation Endpoint", False, "❌ MISSING: POST /api/orders endpoint not implemented")
-        else:
-            log_test("Order Creation Endpoint", True, f"Endpoint exists (HTTP {response.status_code})")
+        requests.delete(f"{BASE_URL}/cart/remove/{test_product_id}", headers=headers, timeout=10)
+        response = requests.post(f"{BASE_URL}/orders", headers=headers, json={
+            "nama_penerima": "A", "alamat": "B", "nomor_whatsapp": "1", "metode_pembayaran": "transfer",
+        }, timeout=10)
+        log_test("Order Empty Cart", response.status_code == 400, f"HTTP {response.status_code}")
     except Exception as e:
-        log_test("Order Creation Endpoint", False, f"Request failed: {str(e)}")
+        log_test("Order Empty Cart", False, f"Request failed: {str(e)}")
     
-    # Test get orders endpoint
+    # Two orders, so the listing has a second page
     try:
-        response = requests.get(f"{BASE_URL}/orders", headers=headers, timeout=10)
-        if response.status_code == 404:
-            log_test("Get Orders Endpoint", False, "❌ MISSING: GET /api/orders endpoint not implemented")
-        else:
-            log_test("Get Orders Endpoint", True, f"Endpoint exists (HTTP {response.status_code})")
+        stock_before = get_product_stock(headers)
+        orders = []
+        for _ in range(2):
+            response = place_test_order(headers)
+            if response.status_code != 200:
+                log_test("Order Creation", False, f"HTTP {response.status_code}", response.text)
+                return False
+            orders.append(response.json())
+        order = orders[-1]
+        ok = order["status"] == "pending" and order["items"][0]["product_id"] == test_product_id and order["total"] == order["subtotal"]
+        log_test("Order Creation", ok, f"Created orders {orders[0]['id']} and {order['id']}", None if ok else order)
+        stock_after = get_product_stock(headers)
+        log_test("Order Stock Deducted", stock_after == stock_before - 2, f"stok {stock_before} -> {stock_after}")
+        test_order_id = order["id"]
     except Exception as e:
-        log_test("Get Orders Endpoint", False, f"Request failed: {str(e)}")
+        log_test("Order Creation", False, f"Request failed: {str(e)}")
+        return False
     
-    # Test get order by ID endpoint
+    # Newest first, one per page
     try:
-        response = requests.get(f"{BASE_URL}/orders/test-id", headers=headers, timeout=10)
-        if response.status_code == 404:
-            log_test("Get Order by ID Endpoint", False, "❌ MISSING: GET /api/orders/{id} endpoint not implemented")
-        else:
-            log_test("Get Order by ID Endpoint", True, f"Endpoint exists (HTTP {response.status_code})")
+        response = requests.get(f"{BASE_URL}/orders", headers=headers, params={"limit": 1}, timeout=10)
+        page = response.json()
+        cursor = response.headers.get("X-Next-Cursor")
+        ok = response.status_code == 200 and [o["id"] for o in page] == [orders[1]["id"]] and cursor is not None
+        log_test("Get Orders First Page", ok, f"HTTP {response.status_code}, {len(page)} orders, next cursor: {bool(cursor)}")
+        if cursor:
+            response = requests.get(f"{BASE_URL}/orders", headers=headers, params={"limit": 1, "cursor": cursor}, timeout=10)
+            page = response.json()
+            ok = response.status_code == 200 and [o["id"] for o in page] == [orders[0]["id"]] and "X-Next-Cursor" not in response.headers
+            log_test("Get Orders Next Page", ok, f"HTTP {response.status_code}, {len(page)} orders")
     except Exception as e:
-        log_test("Get Order by ID Endpoint", False, f"Request failed: {str(e)}")
+        log_test("Get Orders Pagination", False, f"Request failed: {str(e)}")
     
-    # Test update order status endpoint
+    # Status filter
     try:
-        response = requests.put(f"{BASE_URL}/orders/test-id/status", headers=headers, json={"status": "confirmed"}, timeout=10)
-        if response.status_code == 404:
-            log_test("Update Order Status Endpoint", False, "❌ MISSING: PUT /api/orders/{id}/status endpoint not implemented")
-        else:
-            log_test("Update Order Status Endpoint", True, f"Endpoint exists (HTTP {response.status_code})")
+        response = requests.get(f"{BASE_URL}/orders", headers=headers, params={"status": "pending"}, timeout=10)
+        ok = response.status_code == 200 and len(response.json()) == 2
+        log_test("Get Orders by Status", ok, f"HTTP {response.status_code}, {len(response.json())} pending orders")
+        response = requests.get(f"{BASE_URL}/orders", headers=headers, params={"status": "lost"}, timeout=10)
+        log_test("Get Orders Unknown Status", response.status_code == 400, f"HTTP {response.status_code}")
+    except Exception as e:
+        log_test("Get Orders by Status", False, f"Request failed: {str(e)}")
+    
+    # Lookup by id
+    try:
+        response = requests.get(f"{BASE_URL}/orders/{test_order_id}", headers=headers, timeout=10)
+        ok = response.status_code == 200 and response.json()["id"] == test_order_id
+        log_test("Get Order by ID", ok, f"HTTP {response.status_code}")
+        response = requests.get(f"{BASE_URL}/orders/test-id", headers=headers, timeout=10)
+        log_test("Get Unknown Order", response.status_code == 404, f"HTTP {response.status_code}")
     except Exception as e:
-        log_test("Update Order Status Endpoint", False, f"Request failed: {str(e)}")
+        log_test("Get Order by ID", False, f"Request failed: {str(e)}")
+        return False
     
-    return False  # All endpoints are missing
+    return True
 
 def test_order_cancellation_endpoint():
-    """Test order cancellation functionality"""
+    """Test order cancellation and stock restoration"""
     print("\n=== Testing Order Cancellation Endpoint ===")
     
     if not auth_token:
         log_test("Order Cancellation", False, "No auth token available")
         return False
+        
+    if not test_order_id:
+        log_test("Order Cancellation", False, "No order available for testing")
+        return False
     
     headers = {"Authorization": f"Bearer {auth_token}"}
     
     try:
-        response = requests.put(f"{BASE_URL}/orders/test-id/cancel", headers=headers, timeout=10)
-        if response.status_code == 404:
-            log_test("Order Cancellation Endpoint", False, "❌ MISSING: PUT /api/orders/{id}/cancel endpoint not implemented")
+        stock_before = get_product_stock(headers)
+        response = requests.put(f"{BASE_URL}/orders/{test_order_id}/cancel", headers=headers, timeout=10)
+        if response.status_code != 200 or response.json()["status"] != "cancelled":
+            log_test("Order Cancellation", False, f"HTTP {response.status_code}", response.text)
             return False
-        else:
-            log_test("Order Cancellation Endpoint", True, f"Endpoint exists (HTTP {response.status_code})")
-            return True
+        log_test("Order Cancellation", True, f"Cancelled order {test_order_id}")
+        
+        stock_after = get_product_stock(headers)
+        log_test("Order Cancellation Restocks", stock_after == stock_before + 1, f"stok {stock_before} -> {stock_after}")
+        
+        # Only pending orders can be cancelled
+        response = requests.put(f"{BASE_URL}/orders/{test_order_id}/cancel", headers=headers, timeout=10)
+        log_test("Order Cancel Twice", response.status_code == 400, f"HTTP {response.status_code}")
+        
+        response = requests.put(f"{BASE_URL}/orders/test-id/cancel", headers=headers, timeout=10)
+        log_test("Cancel Unknown Order", response.status_code == 404, f"HTTP {response.status_code}")
+        
+        response = requests.get(f"{BASE_URL}/orders", headers=headers, params={"status": "cancelled"}, timeout=10)
+        ok = response.status_code == 200 and [o["id"] for o in response.json()] == [test_order_id]
+        log_test("Get Cancelled Orders", ok, f"HTTP {response.status_code}")
+        return True
     except Exception as e:
-        log_test("Order Cancellation Endpoint", False, f"Request failed: {str(e)}")
+        log_test("Order Cancellation", False, f"Request failed: {str(e)}")
         return False
 
 def test_firebase_integration_endpoints():
@@ -544,24 +613,24 @@ def test_trending_products_endpoints():
     
     # Test trending products endpoint
     try:
-        response = requests.get(f"{BASE_URL}/products/trending", headers=headers, timeout=10)
+        response = requests.get(f"{BASE_URL}/trending", headers=headers, params={"limit": 10}, timeout=10)
         if response.status_code == 404:
-            log_test("Trending Products Endpoint", False, "❌ MISSING: GET /api/products/trending endpoint not implemented")
+            log_test("Trending Products Endpoint", False, "❌ MISSING: GET /api/trending endpoint not implemented")
+        elif response.status_code == 200:
+            products = response.json()
+            log_test("Trending Products Endpoint", True, f"Retrieved {len(products)} trending products")
+            
+            # Unchanged ranking should revalidate with 304
+            etag = response.headers.get("ETag")
+            if etag:
+                cached = requests.get(f"{BASE_URL}/trending", headers={**headers, "If-None-Match": etag}, params={"limit": 10}, timeout=10)
+                log_test("Trending Products ETag", cached.status_code == 304, f"HTTP {cached.status_code}")
+            return True
         else:
-            log_test("Trending Products Endpoint", True, f"Endpoint exists (HTTP {response.status_code})")
+            log_test("Trending Products Endpoint", False, f"HTTP {response.status_code}: {response.text}")
     except Exception as e:
         log_test("Trending Products Endpoint", False, f"Request failed: {str(e)}")
     
-    # Test trending products collection endpoint
-    try:
-        response = requests.get(f"{BASE_URL}/trending-products", headers=headers, timeout=10)
-        if response.status_code == 404:
-            log_test("Trending Products Collection Endpoint", False, "❌ MISSING: GET /api/trending-products endpoint not implemented")
-        else:
-            log_test("Trending Products Collection Endpoint", True, f"Endpoint exists (HTTP {response.status_code})")
-    except Exception as e:
-        log_test("Trending Products Collection Endpoint", False, f"Request failed: {str(e)}")
-    
     return False
 
 def test_firebase_storage_integration():
@@ -596,6 +665,42 @@ def test_firebase_storage_integration():
     
     return False
 
+def test_fast_json_parity():
+    """Check the fast JSON path against the Pydantic models for every stored product and category"""
+    print("\n=== Testing Fast JSON Parity ===")
+    
+    backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+    try:
+        result = subprocess.run(
+            [sys.executable, "fast_json.py", "--db"],
+            cwd=backend_dir, capture_output=True, text=True, timeout=120,
+        )
+        output = (result.stdout or result.stderr).strip().splitlines()
+        log_test("Fast JSON Parity", result.returncode == 0, " / ".join(line for line in output[-3:] if line))
+        return result.returncode == 0
+    except Exception as e:
+        log_test("Fast JSON Parity", False, f"Check failed: {str(e)}")
+    
+    return False
+
+def test_worker_startup_budget():
+    """Check that importing the app stays within the startup budget"""
+    print("\n=== Testing Worker Startup Import Time ===")
+    
+    backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+    try:
+        result = subprocess.run(
+            [sys.executable, "bench_startup.py", "--runs", "3", "--top", "0"],
+            cwd=backend_dir, capture_output=True, text=True, timeout=120,
+        )
+        summary = result.stdout.strip().splitlines()
+        log_test("Worker Startup Budget", result.returncode == 0, " / ".join(line for line in summary if line))
+        return result.returncode == 0
+    except Exception as e:
+        log_test("Worker Startup Budget", False, f"Benchmark failed: {str(e)}")
+    
+    return False
+
 def run_all_tests():
     """Run all backend API tests"""
     print("🚀 Starting Gogama Store Backend API Tests")
@@ -652,6 +757,14 @@ def run_all_tests():
     
     test_trending_products_endpoints()
     
+    # Backend scripts: serializer parity and worker startup time
+    print("\n" + "⏱️" * 60)
+    print("BACKEND SCRIPT CHECKS")
+    print("⏱️" * 60)
+    
+    test_fast_json_parity()
+    test_worker_startup_budget()
+    
     # Summary
     print("\n" + "=" * 60)
     print("📊 COMPREHENSIVE TEST SUMMARY")